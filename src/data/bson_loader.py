@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""BSONLoader: load the mongodb products dump without mongodb."""
+
+import logging
+
+import bson
+import pyarrow as pa
+from tqdm import tqdm
+
+from src.data import schema
+from src.data.parquet_stream import ParquetStreamWriter
+
+logger = logging.getLogger(__file__)
+
+
+class BSONLoader(object):
+    """BSONLoader. Convert `products.bson` to parquet files.
+
+    The dump is read document by document, only the fields used by the
+    project are kept and documents are written by chunks of `chunksize`
+    rows, so the memory usage doesn't depend on the size of the dump. This
+    replaces the docker + mongorestore round trip. Kept fields and their
+    types come from `src.data.schema`.
+
+    :usage:
+        >>> loader = BSONLoader('data/raw/off/products.bson',
+                                'data/raw/products.parquet')
+        >>> loader.run()
+
+    :args:
+        * bson_filepath (str, path like) : the products.bson file
+        * output_dir (str, path like) : destination folder for parquet files
+        * chunksize (int) : number of documents per row group. Optional,
+        default=100 000
+    """
+
+    FIELDS = schema.GENERAL_INFOS + schema.EXTRA
+    NUTRIMENTS = schema.NUTRI_FACTS
+    # fields of the csv export named differently in the mongodb dump
+    FALLBACKS = {'main_category_en': 'main_category',
+                 'image_url': 'image_front_url'}
+
+    def __init__(self, bson_filepath, output_dir, chunksize=100000):
+        self.bson_filepath = str(bson_filepath)
+        self.output_dir = str(output_dir)
+        self.chunksize = chunksize
+        self.schema = schema.arrow_schema(self.FIELDS + self.NUTRIMENTS)
+
+    @staticmethod
+    def _to_str(value):
+        if value is None or isinstance(value, str):
+            return value
+        if isinstance(value, list):
+            return ','.join(str(x) for x in value)
+        return str(value)
+
+    @staticmethod
+    def _to_float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def project(self, document):
+        """Return the kept fields of a document as a flat dict."""
+        record = dict()
+        for name in self.FIELDS:
+            value = document.get(name)
+            if value is None and name in self.FALLBACKS:
+                value = document.get(self.FALLBACKS[name])
+                if isinstance(value, str) and value.startswith('en:'):
+                    value = value[3:]
+            record[name] = self._to_str(value)
+        nutriments = document.get('nutriments') or dict()
+        for name in self.NUTRIMENTS:
+            record[name] = self._to_float(nutriments.get(name))
+        return record
+
+    def _to_table(self, records):
+        columns = {name: [record[name] for record in records]
+                   for name in self.schema.names}
+        return pa.Table.from_pydict(columns, schema=self.schema)
+
+    def run(self):
+        """Convert the dump.
+
+        :returns:
+            n_rows (int) : number of written documents.
+        """
+        logger.info('Loading %s', self.bson_filepath)
+        writer = ParquetStreamWriter(self.output_dir,
+                                     row_group_size=self.chunksize)
+        writer.schema = self.schema
+        writer.begin()
+        records = list()
+        n_rows = 0
+        with open(self.bson_filepath, 'rb') as file:
+            for document in tqdm(bson.decode_file_iter(file),
+                                 desc='Load products', unit='doc'):
+                records.append(self.project(document))
+                if len(records) >= self.chunksize:
+                    writer.write_table(self._to_table(records))
+                    n_rows += len(records)
+                    records = list()
+        if records:
+            writer.write_table(self._to_table(records))
+            n_rows += len(records)
+        writer.finish()
+        logger.info('%i products written in %s', n_rows, self.output_dir)
+        return n_rows
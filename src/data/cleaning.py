@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""cleaning: declarative rules to reject inconsistent products.
+
+Each rule returns a boolean mask of the rows to reject. A RuleSet combines
+all masks with a single `or` per chunk and counts the rows rejected by each
+rule, so a frame is filtered once instead of once per rule.
+
+:usage:
+    >>> rules = RuleSet(NUTRIENT_RULES)
+    >>> data = rules.filter(data)
+    >>> rules.report()
+        sodium_100g > salt_100g                 120
+        saturated-fat_100g > fat_100g            53
+        ...
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src.data import schema
+
+logger = logging.getLogger(__file__)
+
+
+class Rule(object):
+    """Rule. Parent class of cleaning rules.
+
+    Child classes override `reject` which takes a DataFrame and returns a
+    boolean numpy array, True for the rows to drop. Comparisons with NaN
+    are False, missing values are never rejected.
+    """
+
+    name = 'rule'
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name})'
+
+    @staticmethod
+    def values(frame, column):
+        """Column as a float64 array, missing values as NaN."""
+        return frame[column].to_numpy(dtype='float64', na_value=np.nan)
+
+    def reject(self, frame):
+        msg = 'This method should be overriden in child class'
+        raise NotImplementedError(msg)
+
+
+class GreaterThanColumn(Rule):
+    """Reject rows where `column` > `other`, e.g. sugars > carbohydrates."""
+
+    def __init__(self, column, other):
+        self.column = column
+        self.other = other
+        self.name = f'{column} > {other}'
+
+    def reject(self, frame):
+        return (self.values(frame, self.column)
+                > self.values(frame, self.other))
+
+
+class GreaterThanValue(Rule):
+    """Reject rows where `column` > `value`, e.g. energy > 4000."""
+
+    def __init__(self, column, value):
+        self.column = column
+        self.value = value
+        self.name = f'{column} > {value}'
+
+    def reject(self, frame):
+        return self.values(frame, self.column) > self.value
+
+
+class SumGreaterThanValue(Rule):
+    """Reject rows where the sum of `columns` > `value`."""
+
+    def __init__(self, columns, value):
+        self.columns = list(columns)
+        self.value = value
+        self.name = f'{" + ".join(columns)} > {value}'
+
+    def reject(self, frame):
+        total = sum(self.values(frame, column) for column in self.columns)
+        return total > self.value
+
+
+NUTRIENT_RULES = [
+    GreaterThanColumn('sodium_100g', 'salt_100g'),
+    GreaterThanColumn('saturated-fat_100g', 'fat_100g'),
+    GreaterThanColumn('sugars_100g', 'carbohydrates_100g'),
+    SumGreaterThanValue(['fat_100g', 'proteins_100g', 'carbohydrates_100g',
+                         'salt_100g'], 100),
+    GreaterThanValue('energy_100g', 4000),
+] + [GreaterThanValue(column, 100) for column in schema.NUTRI_FACTS[1:]]
+
+
+class RuleSet(object):
+    """RuleSet. Evaluate several rules as one mask.
+
+    Counts are accumulated over every filtered frame or chunk, a row
+    rejected by two rules is counted by both.
+
+    :args:
+        rules (list) : list of Rule. Optional, default=NUTRIENT_RULES
+    """
+
+    def __init__(self, rules=None):
+        self.rules = list(NUTRIENT_RULES if rules is None else rules)
+        self.counts = np.zeros(len(self.rules), dtype='int64')
+        self.n_rows = 0
+        self.n_rejected = 0
+
+    def mask(self, frame):
+        """Return a boolean array, True for the rows to keep."""
+        rejected = np.zeros(len(frame), dtype=bool)
+        for i, rule in enumerate(self.rules):
+            rule_mask = rule.reject(frame)
+            self.counts[i] += np.count_nonzero(rule_mask)
+            rejected |= rule_mask
+        self.n_rows += len(frame)
+        self.n_rejected += np.count_nonzero(rejected)
+        return ~rejected
+
+    def filter(self, frame):
+        """Return the rows of frame that pass every rule."""
+        return frame[self.mask(frame)]
+
+    def filter_chunks(self, chunks):
+        """Filter an iterable of DataFrames (see loaders.read_chunks).
+
+        Only one chunk is in memory at a time.
+        """
+        for chunk in chunks:
+            yield self.filter(chunk)
+
+    def report(self):
+        """Return the number of rows rejected by each rule."""
+        report = pd.Series(self.counts, index=[rule.name
+                                               for rule in self.rules],
+                           name='rejected')
+        logger.info('%i / %i rows rejected.', self.n_rejected, self.n_rows)
+        return report
@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
 """DataDownloader: module used for data downloading."""
 
+import json
 import logging
 import os
 from pathlib import Path
 import requests
 import subprocess
 import tarfile
-from tqdm import tqdm
+
+from src.data.bson_loader import BSONLoader
+from src.data.iter_stream import IterStream
+from src.data.loaders import read_chunks
+from src.data.parquet_stream import ParquetStreamWriter
+from src.data.segmented_download import SegmentedDownload
+from src.data.snapshot_diff import SnapshotDiff
 
 logger = logging.getLogger(__file__)
 
@@ -20,10 +27,30 @@ class DataDownloader(object):
         >>> data_downloader = DataDownloader('path/to/data_dir')
         >>> data_downloader.run()
 
+    The ETag, Last-Modified and content-length of the downloaded file are
+    saved in `<output_filepath>.meta.json`. The next run sends a conditional
+    request and skips the download if the remote file didn't change. For
+    csv and parquet formats, the product codes that are new, changed or
+    deleted since the previous run are written in
+    `interim/products_delta.pickle`.
+
     :args:
         * data_path (str, path like) : destination folder for downloaded files
-        * frmt (str) : should be one of "csv" or "mongodb". Format of downloaded
-        file. Optional, default=csv
+        * frmt (str) : should be one of "csv", "parquet" or "mongodb". Format
+        of downloaded file. Optional, default=csv. With "parquet", the csv
+        export is converted to parquet files while it is downloaded.
+        * columns (list) : parquet only. Columns to keep, e.g.
+        schema.COLUMNS. Optional, default all columns
+        * n_segments (int) : number of parallel connections used for the
+        download. Optional, default=8
+        * stream_extract (bool) : mongodb only. Extract the dump while it is
+        downloaded instead of writing the archive first. Optional,
+        default=False
+        * members (list) : mongodb only. Names of the archive members to
+        extract, e.g. ['off/products.bson']. Optional, default all members
+        * native_loader (bool) : mongodb only. Convert products.bson to
+        parquet files with BSONLoader instead of restoring it in a mongodb
+        docker container. Optional, default=False
     """
 
     BASE_URL = 'https://static.openfoodfacts.org/data/'
@@ -34,9 +61,15 @@ class DataDownloader(object):
         logger.debug('Init DataDownloader object with arg : %s, %s, %s',
                      data_path, frmt, kwargs)
         self.data_format = frmt.lower()
+        self.n_segments = kwargs.get('n_segments', 8)
+        self.columns = kwargs.get('columns')
         self.data_path = Path(os.path.join(data_path, 'raw')).resolve()
+        self.interim_path = self.data_path.parents[0].joinpath('interim')
         if self.data_format == 'csv':
             self.output_filepath = os.path.join(self.data_path, 'products.csv')
+        elif self.data_format == 'parquet':
+            self.output_filepath = os.path.join(self.data_path,
+                                                'products.parquet')
         elif self.data_format == 'mongodb':
             self.output_filepath = os.path.join(self.data_path,
                                                 'mongodbdump.tar.gz')
@@ -44,6 +77,9 @@ class DataDownloader(object):
             if not self.container_name:
                 self.container_name = 'openfoodfacts'
             self.dump_location = os.path.join(data_path, 'dump')
+            self.stream_extract = kwargs.get('stream_extract', False)
+            self.members = kwargs.get('members')
+            self.native_loader = kwargs.get('native_loader', False)
 
     @property
     def _headers(self):
@@ -61,34 +97,141 @@ class DataDownloader(object):
         if not os.path.exists(self.data_path):
             logger.info('Creating directories.')
             logger.debug(self.data_path)
-            os.mkdir(self.data_path.parents[0])
             for dir in data_dirs:
-                os.mkdir(os.path.join(self.data_path.parents[0], dir))
+                os.makedirs(os.path.join(self.data_path.parents[0], dir),
+                            exist_ok=True)
         else:
             logger.info('Data directories already exists.')
 
-    def _fetch_data(self):
-        """Method used to fetch the data on the website using requests."""
-        logger.info('Start download, this can take a while...')
-        if self.data_format == 'csv':
-            response = requests.get(self.CSV_URL, stream=True,
-                                    headers=self._headers)
+    @property
+    def url(self):
+        """Return the URL of the file to download."""
+        if self.data_format in ('csv', 'parquet'):
+            return self.CSV_URL
         elif self.data_format == 'mongodb':
-            response = requests.get(self.MONGO_URL, stream=True,
-                                    headers=self._headers)
+            return self.MONGO_URL
+        raise ValueError("Wrong format argument.")
+
+    @property
+    def metadata_filepath(self):
+        return str(self.output_filepath) + '.meta.json'
+
+    def _load_metadata(self):
+        """Return the metadata saved by the last run (empty dict if none)."""
+        try:
+            with open(self.metadata_filepath) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return dict()
+
+    def local_export_exists(self):
+        """Return True if the result of the last download is on disk.
+
+        A file with a SegmentedDownload state sidecar is a partial download,
+        not an export.
+        """
+        if os.path.exists(str(self.output_filepath) + '.state'):
+            return False
+        if self.data_format != 'mongodb':
+            return os.path.exists(self.output_filepath)
+        if self.native_loader:
+            return self.data_path.joinpath('products.parquet').exists()
+        return next(self.data_path.rglob('products.bson'), None) is not None
+
+    def _remote_metadata(self):
+        """Send a conditional request for the remote file.
+
+        The request is conditional only if the local export still exists,
+        otherwise the file is always downloaded again.
+
+        :returns:
+            (modified, metadata) : modified is False if the server answered
+            304 Not Modified or returned the same validators as last run.
+        """
+        if not self.local_export_exists():
+            logger.info('No local export, the file will be downloaded.')
+            previous = dict()
         else:
-            raise ValueError("Wrong format argument.")
-        content_length = int(response.headers.get('content-length'))
-        # Use tqdm to monitore the progress of the downloading progress
-        with open(self.output_filepath, 'wb') as file:
-            chunk_size = 1024 * 1024
-            for data in tqdm(response.iter_content(chunk_size=chunk_size),
-                             total=content_length // chunk_size,
-                             desc='Download data',
-                             unit='Mo'):
-                file.write(data)
+            previous = self._load_metadata()
+        headers = dict(self._headers)
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+        with requests.get(self.url, stream=True, headers=headers) as response:
+            if response.status_code == 304:
+                return False, previous
+            response.raise_for_status()
+            metadata = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_length': response.headers.get('content-length'),
+            }
+        validators = ('etag', 'last_modified', 'content_length')
+        unchanged = (any(metadata[name] for name in validators[:2])
+                     and all(metadata[name] == previous.get(name)
+                             for name in validators))
+        return not unchanged, metadata
+
+    def _save_metadata(self, metadata):
+        with open(self.metadata_filepath, 'w') as file:
+            json.dump(metadata, file)
+
+    def diff_snapshot(self):
+        """Write the codes changed since the previous run.
+
+        :returns:
+            delta (pd.DataFrame) : columns `code` and `status`. See
+            SnapshotDiff.
+        """
+        logger.info('Computing changes since the previous export.')
+        diff = SnapshotDiff(self.interim_path.joinpath(
+            'products_hashes.pickle'))
+        delta = diff.compute(read_chunks(self.output_filepath))
+        delta.to_pickle(self.interim_path.joinpath('products_delta.pickle'))
+        diff.save()
+        return delta
+
+    def _fetch_data(self):
+        """Method used to fetch the data on the website.
+
+        The file is downloaded with several HTTP Range requests in parallel
+        and the download resumes after an interruption. See
+        SegmentedDownload.
+        """
+        logger.info('Start download, this can take a while...')
+        download = SegmentedDownload(self.url, self.output_filepath,
+                                     n_segments=self.n_segments,
+                                     headers=self._headers)
+        download.run()
         logger.info('Download finished.')
 
+    def _stream_to_parquet(self):
+        """Download the csv export and write it as parquet on the fly.
+
+        The response is parsed while it is downloaded, the raw csv is never
+        stored on disk. See ParquetStreamWriter.
+        """
+        logger.info('Start download and conversion to parquet...')
+        response = requests.get(self.url, stream=True, headers=self._headers)
+        response.raise_for_status()
+        writer = ParquetStreamWriter(self.output_filepath,
+                                     columns=self.columns)
+        with response:
+            chunks = response.iter_content(chunk_size=1024 * 1024)
+            writer.write_stream(IterStream(chunks))
+        logger.info('Conversion finished.')
+
+    def _selected_members(self, tar):
+        """Yield the archive members to extract (see `members` arg)."""
+        for member in tar:
+            if self.members and not any(
+                    member.name == name or member.name.endswith('/' + name)
+                    for name in self.members):
+                logger.debug('Skip %s', member.name)
+                continue
+            yield member
+
     def _extract_mongo_dump(self, purge=True):
         """Method to extract the content of the tarfile.
 
@@ -96,11 +239,42 @@ class DataDownloader(object):
         """
         logger.info("Extracting the dump from the tar archive.")
         with tarfile.open(self.output_filepath, 'r:gz') as tar:
-            tar.extractall(self.data_path)
+            tar.extractall(self.data_path,
+                           members=self._selected_members(tar))
         if purge:
             os.remove(self.output_filepath)
         logger.info("Extraction done.")
 
+    def _stream_extract_mongo_dump(self):
+        """Download the mongodb dump and extract it on the fly.
+
+        The response is read as a gzip stream ('r|gz'), members are
+        extracted while the archive is downloaded and the archive itself is
+        never written to disk.
+        """
+        logger.info('Start download and extraction, this can take a while...')
+        response = requests.get(self.url, stream=True, headers=self._headers)
+        response.raise_for_status()
+        with response:
+            chunks = response.iter_content(chunk_size=1024 * 1024)
+            with tarfile.open(fileobj=IterStream(chunks), mode='r|gz') as tar:
+                for member in self._selected_members(tar):
+                    logger.info('Extracting %s', member.name)
+                    tar.extract(member, self.data_path)
+        logger.info("Extraction done.")
+
+    def _load_bson(self):
+        """Convert the extracted products.bson to parquet files.
+
+        See BSONLoader. The result is written in `raw/products.parquet`.
+        """
+        bson_filepath = next(self.data_path.rglob('products.bson'), None)
+        if bson_filepath is None:
+            raise FileNotFoundError('products.bson not found in %s'
+                                    % self.data_path)
+        output_dir = self.data_path.joinpath('products.parquet')
+        BSONLoader(bson_filepath, output_dir).run()
+
     def _start_mongo_docker_instance(self):
         """Wrapper method to start a docker container.
 
@@ -141,11 +315,34 @@ class DataDownloader(object):
                 logging.error(line.decode('ascii'))
         logger.info("Database successfully restored.")
 
-    def run(self):
-        """Lauch the full process."""
+    def run(self, force=False):
+        """Lauch the full process.
+
+        :args:
+            force (bool) : download even if the remote file didn't change.
+        :returns:
+            downloaded (bool) : False if the download was skipped.
+        """
         self.init_data_dir()
-        self._fetch_data()
+        modified, metadata = self._remote_metadata()
+        if not modified and not force:
+            logger.info('Remote file not modified since last run, skip.')
+            return False
+        if self.data_format == 'parquet':
+            self._stream_to_parquet()
+        elif self.data_format == 'mongodb' and self.stream_extract:
+            self._stream_extract_mongo_dump()
+        else:
+            self._fetch_data()
         if self.data_format == 'mongodb':
-            self._extract_mongo_dump()
-            self._start_mongo_docker_instance()
-            self._load_dumb_in_mongo()
+            if not self.stream_extract:
+                self._extract_mongo_dump()
+            if self.native_loader:
+                self._load_bson()
+            else:
+                self._start_mongo_docker_instance()
+                self._load_dumb_in_mongo()
+        else:
+            self.diff_snapshot()
+        self._save_metadata(metadata)
+        return True
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""ImageFetcher: bulk download of product pictures."""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+logger = logging.getLogger(__file__)
+
+
+class ImageFetcher(object):
+    """ImageFetcher. Download pictures in a content-addressed cache.
+
+    Pictures are stored under `picts_dir/objects/<2 first chars>/<sha256>`
+    with the extension of the URL, so a picture shared by several products
+    is stored once. `index.json` maps each URL to its file: an URL already
+    in the index is not requested again. Failed URLs are saved in
+    `failures.json` with the error and can be retried with
+    `retry_failures`.
+
+    Downloads use a thread pool of `max_workers` sharing a pooled session:
+    the work is network bound, processes would only add overhead. The index
+    is saved every `save_every` downloads and when fetch stops, even on an
+    error or an interruption.
+
+    :usage:
+        >>> fetcher = ImageFetcher('data/raw/picts')
+        >>> fetcher.fetch(data['image_url'].dropna())
+        >>> fetcher.get('https://static.openfoodfacts.org/images/...jpg')
+            PosixPath('data/raw/picts/objects/3f/3f2a...jpg')
+
+    :args:
+        * picts_dir (str, path like) : cache folder
+        * max_workers (int) : number of concurrent downloads. Optional,
+        default=16
+        * timeout (float) : timeout of each request in seconds. Optional,
+        default=30
+        * session (requests.Session) : session to use. Optional
+        * save_every (int) : number of downloads between two saves of the
+        index. Optional, default=500
+    """
+
+    def __init__(self, picts_dir, max_workers=16, timeout=30, session=None,
+                 save_every=500):
+        self.picts_dir = Path(picts_dir)
+        self.index_filepath = self.picts_dir.joinpath('index.json')
+        self.failures_filepath = self.picts_dir.joinpath('failures.json')
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.save_every = save_every
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4,
+                                  pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.index = self._load(self.index_filepath)
+        self.failures = self._load(self.failures_filepath)
+        self._lock = threading.Lock()
+
+    @property
+    def _headers(self):
+        return {"User-Agent": "Mozilla/5.0"}
+
+    @staticmethod
+    def _load(filepath):
+        try:
+            with open(filepath) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return dict()
+
+    @staticmethod
+    def _dump(obj, filepath):
+        tmp = str(filepath) + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(obj, file)
+        os.replace(tmp, filepath)
+
+    def save(self):
+        """Write the index and the failures on disk."""
+        self.picts_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._dump(self.index, self.index_filepath)
+            self._dump(self.failures, self.failures_filepath)
+
+    def path_for(self, digest, url):
+        """Return the cache path of a picture from its content hash."""
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        return self.picts_dir.joinpath('objects', digest[:2],
+                                       digest + extension)
+
+    def get(self, url):
+        """Return the local path of a downloaded picture, None otherwise."""
+        name = self.index.get(url)
+        if name is None:
+            return None
+        path = self.picts_dir.joinpath(name)
+        return path if path.exists() else None
+
+    def _download(self, url):
+        """Download one picture, return its path relative to picts_dir."""
+        response = self.session.get(url, headers=self._headers,
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        digest = hashlib.sha256(response.content).hexdigest()
+        path = self.path_for(digest, url)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + f'.{threading.get_ident()}.tmp')
+            with open(tmp, 'wb') as file:
+                file.write(response.content)
+            os.replace(tmp, path)
+        return str(path.relative_to(self.picts_dir))
+
+    def _collect(self, futures):
+        """Store the downloads as they complete, return the failures."""
+        n_failures = 0
+        completed = tqdm(as_completed(futures), total=len(futures),
+                         desc='Download pictures')
+        for n_done, future in enumerate(completed, 1):
+            url = futures[future]
+            try:
+                name = future.result()
+            except (requests.RequestException, OSError) as e:
+                n_failures += 1
+                with self._lock:
+                    self.failures[url] = str(e)
+                continue
+            with self._lock:
+                self.index[url] = name
+                self.failures.pop(url, None)
+            if n_done % self.save_every == 0:
+                self.save()
+        return n_failures
+
+    def fetch(self, urls):
+        """Download the pictures missing from the cache.
+
+        :args:
+            urls (iterable) : pictures' URL, duplicates are fetched once.
+        :returns:
+            n_failures (int) : number of URL that couldn't be downloaded.
+        """
+        todo = [url for url in dict.fromkeys(urls) if self.get(url) is None]
+        logger.info('%i pictures to download.', len(todo))
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self._download, url): url
+                           for url in todo}
+                try:
+                    n_failures = self._collect(futures)
+                except BaseException:
+                    # interrupted: don't start the pending downloads
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            self.save()
+        if n_failures:
+            logger.warning('%i downloads failed, see %s', n_failures,
+                           self.failures_filepath)
+        return n_failures
+
+    def retry_failures(self):
+        """Try again the URL saved in failures.json."""
+        return self.fetch(list(self.failures))
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""IterStream: read only file object over an iterator of bytes."""
+
+import io
+
+
+class IterStream(io.RawIOBase):
+    """IterStream. Expose an iterator of bytes chunks as a binary file.
+
+    Used to feed a streamed HTTP response (`response.iter_content`) to
+    readers expecting a file object (csv parser, tarfile, ...).
+
+    :usage:
+        >>> response = requests.get(url, stream=True)
+        >>> chunks = response.iter_content(2**20)
+        >>> stream = io.BufferedReader(IterStream(chunks))
+        >>> stream.readline()
+
+    :args:
+        * iterable (iterable of bytes) : chunks of data
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._leftover = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            chunk = self._leftover or next(self._iterator)
+        except StopIteration:
+            return 0
+        size = min(len(buffer), len(chunk))
+        buffer[:size] = chunk[:size]
+        self._leftover = chunk[size:]
+        return size
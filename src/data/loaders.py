@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""loaders: read the raw export by chunks."""
+
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.data import schema
+
+
+def read_chunks(filepath, chunksize=100000, columns=None):
+    """Yield the raw export as DataFrames of at most `chunksize` rows.
+
+    Only `columns` are read and they are parsed with the compact dtypes of
+    `src.data.schema`. Use `schema.concat` to join the chunks.
+
+    :args:
+        * filepath (str, path like) : csv export (tab separated) or parquet
+        file / directory written by ParquetStreamWriter
+        * chunksize (int) : number of rows per chunk. Optional,
+        default=100 000
+        * columns (list) : columns to read. Optional,
+        default=schema.COLUMNS
+
+    :usage:
+        >>> for chunk in read_chunks('data/raw/products.parquet'):
+        >>>     chunk.shape
+            (100000, 18)
+    """
+    filepath = str(filepath)
+    columns = schema.COLUMNS if columns is None else columns
+    if os.path.isdir(filepath) or filepath.endswith('.parquet'):
+        yield from _read_parquet_chunks(filepath, chunksize, columns)
+    else:
+        yield from _read_csv_chunks(filepath, chunksize, columns)
+
+
+def _read_csv_chunks(filepath, chunksize, columns):
+    return pd.read_csv(filepath, sep='\t', usecols=columns,
+                       chunksize=chunksize,
+                       dtype=schema.pandas_dtypes(columns),
+                       on_bad_lines='skip')
+
+
+def _read_parquet_chunks(filepath, chunksize, columns):
+    if os.path.isdir(filepath):
+        files = sorted(os.path.join(filepath, name)
+                       for name in os.listdir(filepath)
+                       if name.endswith('.parquet'))
+    else:
+        files = [filepath]
+    for file in files:
+        parquet_file = pq.ParquetFile(file)
+        for batch in parquet_file.iter_batches(batch_size=chunksize,
+                                               columns=columns):
+            yield schema.apply_dtypes(batch.to_pandas())
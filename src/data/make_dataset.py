@@ -13,15 +13,33 @@ from src.data.data_downloader import DataDownloader
 
 @click.command()
 @click.argument('input_filepath', type=click.Path())
-@click.option('-f', '--format', type=click.Choice(['csv', 'mongodb']),
+@click.option('-f', '--format',
+              type=click.Choice(['csv', 'parquet', 'mongodb']),
               default='csv')
-def main(input_filepath, format):
+@click.option('-n', '--n-segments', type=int, default=8,
+              help='Number of parallel connections for the download.')
+@click.option('--force', is_flag=True,
+              help='Download even if the remote file did not change.')
+@click.option('--stream-extract', is_flag=True,
+              help='mongodb only: extract the dump while downloading it.')
+@click.option('--products-only', is_flag=True,
+              help='mongodb only: extract only off/products.bson.')
+@click.option('--no-docker', is_flag=True,
+              help='mongodb only: convert products.bson to parquet without '
+                   'restoring it in a mongodb container.')
+def main(input_filepath, format, n_segments, force, stream_extract,
+         products_only, no_docker):
     """Download data."""
     logger = logging.getLogger(__name__)
     logger.info('making data set.')
     input_filepath = Path(input_filepath).resolve().parents[0]
-    data_downloader = DataDownloader(input_filepath, frmt=format)
-    data_downloader.run()
+    members = ['off/products.bson'] if products_only else None
+    data_downloader = DataDownloader(input_filepath, frmt=format,
+                                     n_segments=n_segments,
+                                     stream_extract=stream_extract,
+                                     members=members,
+                                     native_loader=no_docker)
+    data_downloader.run(force=force)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""ParquetStreamWriter: convert a tab separated stream to parquet files."""
+
+import io
+import logging
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from src.data import schema
+
+logger = logging.getLogger(__file__)
+
+
+class ParquetStreamWriter(object):
+    """ParquetStreamWriter. Parse a TSV stream while it is being read.
+
+    The stream is parsed block by block and written to a directory of parquet
+    files (`part-00000.parquet`, `part-00001.parquet`, ...) with row groups of
+    `row_group_size` rows. Only one row group is held in memory at a time.
+    Every part shares the same schema, built from the header line with the
+    types of `src.data.schema`: categories, float32 nutrients and strings.
+    If `columns` is given, the other columns are skipped while parsing.
+    Numeric columns are parsed as strings and cast batch by batch: a value
+    that is not a number becomes null instead of stopping the conversion.
+
+    Between `begin` and `finish` (done by write_stream), the parts are
+    written in `<output_dir>.tmp` which then replaces output_dir: the parts
+    of a previous export are never mixed with the new ones.
+
+    :usage:
+        >>> writer = ParquetStreamWriter('data/raw/products.parquet')
+        >>> with open('products.csv', 'rb') as stream:
+        >>>     writer.write_stream(stream)
+
+    :args:
+        * output_dir (str, path like) : destination folder for parquet files
+        * row_group_size (int) : number of rows per row group. Optional,
+        default=100 000
+        * rows_per_file (int) : number of rows per parquet file. Optional,
+        default=1 000 000
+        * block_size (int) : size in bytes of blocks parsed at once.
+        Optional, default=16 MiB
+        * columns (list) : columns to keep, e.g. schema.COLUMNS. Optional,
+        default all columns
+    """
+
+    def __init__(self, output_dir, row_group_size=100000,
+                 rows_per_file=1000000, block_size=16 * 1024 * 1024,
+                 columns=None):
+        self.output_dir = str(output_dir)
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.rows_per_file = max(rows_per_file, row_group_size)
+        self.block_size = block_size
+        self.schema = None
+        self._target_dir = self.output_dir
+        self._writer = None
+        self._part = 0
+        self._rows_in_part = 0
+
+    def build_schema(self, column_names):
+        """Return the fixed arrow schema used for every row group."""
+        if self.columns is not None:
+            column_names = [name for name in self.columns
+                            if name in column_names]
+        return schema.arrow_schema(column_names)
+
+    def _read_schema(self):
+        """self.schema with the numeric columns read as strings."""
+        return pa.schema([pa.field(field.name, pa.string())
+                          if pa.types.is_floating(field.type) else field
+                          for field in self.schema])
+
+    def _read_options(self, column_names):
+        read_options = pa_csv.ReadOptions(column_names=column_names,
+                                          block_size=self.block_size)
+        parse_options = pa_csv.ParseOptions(
+            delimiter='\t', quote_char=False,
+            invalid_row_handler=self._skip_invalid_row)
+        convert_options = pa_csv.ConvertOptions(
+            column_types=self._read_schema(),
+            include_columns=self.schema.names, strings_can_be_null=True)
+        return read_options, parse_options, convert_options
+
+    @staticmethod
+    def _parse_float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _cast_batch(self, batch):
+        """Cast the numeric columns of a batch read by _read_options."""
+        columns = list()
+        for field, column in zip(self.schema, batch.columns):
+            if column.type != field.type:
+                try:
+                    column = pc.cast(column, field.type)
+                except pa.ArrowInvalid:
+                    values = [self._parse_float(value)
+                              for value in column.to_pylist()]
+                    n_invalid = sum(value is None for value in values) \
+                        - column.null_count
+                    logger.debug('%i invalid values in %s set to null',
+                                 n_invalid, field.name)
+                    column = pa.array(values, type=field.type)
+            columns.append(column)
+        return pa.RecordBatch.from_arrays(columns, schema=self.schema)
+
+    @staticmethod
+    def _skip_invalid_row(row):
+        logger.debug('Skip invalid row %s', row.number)
+        return 'skip'
+
+    def _part_filepath(self):
+        return os.path.join(self._target_dir,
+                            f'part-{self._part:05d}.parquet')
+
+    def write_table(self, table):
+        """Write a table in the current part, opening a new one if full."""
+        if self._writer is None:
+            os.makedirs(self._target_dir, exist_ok=True)
+            self._writer = pq.ParquetWriter(self._part_filepath(),
+                                            self.schema)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self._rows_in_part += table.num_rows
+        if self._rows_in_part >= self.rows_per_file:
+            self.close()
+
+    def close(self):
+        """Close the current part file."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._part += 1
+            self._rows_in_part = 0
+
+    def begin(self):
+        """Start a new export in a temporary folder, see finish."""
+        self._target_dir = self.output_dir + '.tmp'
+        shutil.rmtree(self._target_dir, ignore_errors=True)
+        self._part = 0
+
+    def finish(self):
+        """Close the last part and replace output_dir by the new export."""
+        self.close()
+        if self._target_dir == self.output_dir:
+            return
+        os.makedirs(self._target_dir, exist_ok=True)
+        if os.path.isdir(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        elif os.path.exists(self.output_dir):
+            os.remove(self.output_dir)
+        os.replace(self._target_dir, self.output_dir)
+        self._target_dir = self.output_dir
+
+    def write_stream(self, stream):
+        """Parse the binary stream and write it as parquet files.
+
+        :args:
+            stream (file like) : binary stream of tab separated values with
+            a header line.
+        :returns:
+            n_rows (int) : number of written rows.
+        """
+        if not isinstance(stream, io.BufferedIOBase):
+            stream = io.BufferedReader(stream)
+        header = stream.readline().decode('utf-8').rstrip('\r\n')
+        column_names = header.split('\t')
+        self.schema = self.build_schema(column_names)
+
+        reader = pa_csv.open_csv(stream, *self._read_options(column_names))
+        self.begin()
+        batches = list()
+        n_buffered = 0
+        n_rows = 0
+        for batch in reader:
+            batches.append(self._cast_batch(batch))
+            n_buffered += batch.num_rows
+            if n_buffered >= self.row_group_size:
+                table = pa.Table.from_batches(batches, schema=self.schema)
+                self.write_table(table)
+                n_rows += n_buffered
+                batches, n_buffered = list(), 0
+        if batches:
+            self.write_table(pa.Table.from_batches(batches,
+                                                   schema=self.schema))
+            n_rows += n_buffered
+        self.finish()
+        logger.info('%i rows written in %s', n_rows, self.output_dir)
+        return n_rows
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""pipeline: run data processing stages, skipping the up to date ones."""
+
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+import hashlib
+import inspect
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__file__)
+
+
+class Stage(object):
+    """Stage. A step of the pipeline.
+
+    A stage reads its `inputs` files and writes its `outputs` files. It is
+    called as `func(inputs, outputs, **params)` where inputs and outputs are
+    lists of Path.
+
+    :args:
+        * name (str) : unique name of the stage
+        * func (callable) : function doing the work. Must be defined at
+        module level to run in a process pool.
+        * inputs (list) : files (or directories) read by the stage
+        * outputs (list) : files (or directories) written by the stage
+        * params (dict) : keyword arguments given to func. Optional
+        * code (list) : modules whose source is part of the fingerprint
+        (for example the parsers used by func). Optional
+        * always_run (bool) : never skip this stage, for stages checking
+        their own freshness like the download. Optional, default=False
+
+    :usage:
+        >>> Stage('parse', parse_quantity,
+                  inputs=['data/interim/cleaned.pickle'],
+                  outputs=['data/interim/quantity.pickle'],
+                  code=[src.utils.parsers])
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), params=None,
+                 code=(), always_run=False):
+        self.name = name
+        self.func = func
+        self.inputs = [Path(path) for path in inputs]
+        self.outputs = [Path(path) for path in outputs]
+        self.params = params or dict()
+        self.code = list(code)
+        self.always_run = always_run
+
+    def __repr__(self):
+        return f'Stage({self.name})'
+
+    @staticmethod
+    def _path_signature(path):
+        """Cheap signature of a file or directory: size and mtime."""
+        if not path.exists():
+            return [str(path), None]
+        if path.is_dir():
+            files = sorted(p for p in path.rglob('*') if p.is_file())
+        else:
+            files = [path]
+        return [[str(p), p.stat().st_size, p.stat().st_mtime_ns]
+                for p in files]
+
+    def fingerprint(self):
+        """Hash of the stage's code, parameters and inputs."""
+        sha = hashlib.sha256()
+        sha.update(inspect.getsource(self.func).encode('utf-8'))
+        for module in self.code:
+            sha.update(inspect.getsource(module).encode('utf-8'))
+        sha.update(repr(sorted(self.params.items())).encode('utf-8'))
+        for path in self.inputs:
+            sha.update(json.dumps(self._path_signature(path)).encode('utf-8'))
+        return sha.hexdigest()
+
+    def run(self):
+        self.func(self.inputs, self.outputs, **self.params)
+
+
+class Pipeline(object):
+    """Pipeline. Run stages in dependency order.
+
+    A stage depends on another one if it reads one of its outputs. The
+    fingerprint of each successful stage is saved in `cache_dir`; on the
+    next run a stage whose fingerprint didn't change and whose outputs exist
+    is skipped. Stages that don't depend on each other run concurrently.
+
+    :usage:
+        >>> pipeline = Pipeline([download, projection, cleaning],
+                                cache_dir='data/.pipeline')
+        >>> pipeline.run()
+
+    :args:
+        * stages (list) : list of Stage
+        * cache_dir (str, path like) : folder for stage fingerprints
+        * max_workers (int) : number of stages run at the same time.
+        Optional, default=os.cpu_count()
+        * processes (bool) : run stages in a process pool instead of a
+        thread pool. Optional, default=False
+    """
+
+    def __init__(self, stages, cache_dir, max_workers=None, processes=False):
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError('Stage names must be unique.')
+        self.cache_dir = Path(cache_dir)
+        self.max_workers = max_workers or os.cpu_count()
+        self.processes = processes
+        self.dependencies = self._dependencies()
+
+    def _dependencies(self):
+        producers = dict()
+        for stage in self.stages.values():
+            for path in stage.outputs:
+                if path in producers:
+                    raise ValueError(f'{path} is written by '
+                                     f'{producers[path]} and {stage.name}')
+                producers[path] = stage.name
+        dependencies = dict()
+        for stage in self.stages.values():
+            dependencies[stage.name] = {producers[path]
+                                        for path in stage.inputs
+                                        if path in producers}
+        return dependencies
+
+    def _cache_filepath(self, stage):
+        return self.cache_dir.joinpath(f'{stage.name}.json')
+
+    def is_up_to_date(self, stage):
+        """True if the stage ran with the same fingerprint."""
+        if stage.always_run:
+            return False
+        if not all(path.exists() for path in stage.outputs):
+            return False
+        try:
+            with open(self._cache_filepath(stage)) as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return False
+        return cache.get('fingerprint') == stage.fingerprint()
+
+    def _save_fingerprint(self, stage):
+        with open(self._cache_filepath(stage), 'w') as file:
+            json.dump({'fingerprint': stage.fingerprint()}, file)
+
+    def _ordered_stages(self):
+        """Check there is no cycle and return stages in dependency order."""
+        ordered, done = list(), set()
+        pending = dict(self.dependencies)
+        while pending:
+            ready = [name for name, deps in pending.items() if deps <= done]
+            if not ready:
+                raise ValueError(f'Cyclic dependencies in {list(pending)}')
+            for name in ready:
+                ordered.append(name)
+                done.add(name)
+                del pending[name]
+        return ordered
+
+    def run(self, force=False):
+        """Run the pipeline.
+
+        :args:
+            force (bool) : run every stage, even the up to date ones.
+        :returns:
+            executed (list) : names of the stages that ran.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        order = self._ordered_stages()
+        pool_class = ProcessPoolExecutor if self.processes \
+            else ThreadPoolExecutor
+        done, executed, running = set(), list(), dict()
+        with pool_class(max_workers=self.max_workers) as executor:
+            while len(done) < len(order):
+                for name in order:
+                    if (name in done or name in running.values()
+                            or not self.dependencies[name] <= done):
+                        continue
+                    stage = self.stages[name]
+                    if not force and self.is_up_to_date(stage):
+                        logger.info('%s is up to date, skip.', name)
+                        done.add(name)
+                        continue
+                    logger.info('Running %s.', name)
+                    future = executor.submit(stage.func, stage.inputs,
+                                             stage.outputs, **stage.params)
+                    running[future] = name
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    future.result()
+                    self._save_fingerprint(self.stages[name])
+                    executed.append(name)
+                    done.add(name)
+        return executed
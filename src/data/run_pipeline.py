@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""run_pipeline: script to run to build the data, from download to app.
+
+Stages whose code and inputs didn't change since the last run are skipped.
+
+:usage:
+    $ src/data/run_pipeline.py ./data/
+"""
+import click
+import logging
+
+from src.data.stages import make_pipeline
+
+
+@click.command()
+@click.argument('data_dir', type=click.Path())
+@click.option('-f', '--format', type=click.Choice(['csv', 'parquet']),
+              default='csv')
+@click.option('-j', '--jobs', type=int, default=None,
+              help='Number of stages run at the same time.')
+@click.option('--processes', is_flag=True,
+              help='Run stages in processes instead of threads.')
+@click.option('--force', is_flag=True, help='Run every stage.')
+def main(data_dir, format, jobs, processes, force):
+    """Run the data pipeline."""
+    logger = logging.getLogger(__name__)
+    pipeline = make_pipeline(data_dir, frmt=format, max_workers=jobs,
+                             processes=processes)
+    executed = pipeline.run(force=force)
+    logger.info('Executed stages: %s', ', '.join(executed) or 'none')
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
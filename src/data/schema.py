@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""schema: columns kept from the export and their types.
+
+Loaders read only these columns and give them compact types while parsing:
+categories for the columns with few distinct values, float32 for nutrition
+facts and an arrow backed string for the product code (one buffer instead
+of a python object per row).
+
+:usage:
+    >>> from src.data import schema
+    >>> pd.read_csv(path, sep='\t', usecols=schema.COLUMNS,
+                    dtype=schema.pandas_dtypes())
+"""
+
+import pandas as pd
+import pyarrow as pa
+
+GENERAL_INFOS = ['code', 'product_name', 'brands', 'pnns_groups_1',
+                 'pnns_groups_2', 'quantity', 'nutriscore_grade',
+                 'main_category_en']
+
+NUTRI_FACTS = ['energy_100g', 'proteins_100g', 'fat_100g',
+               'carbohydrates_100g', 'salt_100g', 'sodium_100g',
+               'saturated-fat_100g', 'sugars_100g', 'fiber_100g']
+
+EXTRA = ['image_url']
+
+COLUMNS = GENERAL_INFOS + NUTRI_FACTS + EXTRA
+
+CATEGORICALS = ['brands', 'pnns_groups_1', 'pnns_groups_2',
+                'nutriscore_grade', 'main_category_en']
+
+CODE_DTYPE = 'string[pyarrow]'
+
+
+def arrow_type(name):
+    """Return the arrow type of a column of the export."""
+    if name in CATEGORICALS:
+        return pa.dictionary(pa.int32(), pa.string())
+    if name.endswith('_100g'):
+        return pa.float32()
+    return pa.string()
+
+
+def arrow_schema(columns=None):
+    """Return the arrow schema for `columns` (default: COLUMNS)."""
+    columns = COLUMNS if columns is None else columns
+    return pa.schema([pa.field(name, arrow_type(name)) for name in columns])
+
+
+def pandas_dtype(name):
+    """Return the pandas dtype of a column of the export."""
+    if name == 'code':
+        return CODE_DTYPE
+    if name in CATEGORICALS:
+        return 'category'
+    if name.endswith('_100g'):
+        return 'float32'
+    return 'object'
+
+
+def pandas_dtypes(columns=None):
+    """Return a {column: dtype} dict usable with pd.read_csv."""
+    columns = COLUMNS if columns is None else columns
+    return {name: pandas_dtype(name) for name in columns}
+
+
+def apply_dtypes(frame):
+    """Cast the known columns of a DataFrame to their compact dtype."""
+    dtypes = {name: dtype for name, dtype in pandas_dtypes(frame.columns)
+              .items() if dtype != 'object'}
+    return frame.astype(dtypes)
+
+
+def concat(frames):
+    """Concatenate chunks keeping categorical columns categorical.
+
+    Each chunk has its own categories, pd.concat would fall back to object
+    dtype, so the categories are unified first.
+    """
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS).pipe(apply_dtypes)
+    for name in frames[0].columns:
+        if isinstance(frames[0][name].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals(
+                [frame[name] for frame in frames]).categories
+            for frame in frames:
+                frame[name] = frame[name].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""SegmentedDownload: resumable, multi-connection HTTP download."""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+logger = logging.getLogger(__file__)
+
+
+class SegmentedDownload(object):
+    """SegmentedDownload. Fetch a large file with HTTP Range requests.
+
+    The file is split in `n_segments` byte ranges downloaded in parallel over
+    a pooled session. Progress of each segment is saved in a sidecar state
+    file (`<output_filepath>.state`) so an interrupted download restarts
+    where it stopped. If the server doesn't support ranges, the file is
+    downloaded with a single stream.
+
+    :usage:
+        >>> download = SegmentedDownload('http://host/file.csv',
+                                         'data/raw/file.csv')
+        >>> download.run()
+
+    :args:
+        * url (str) : URL of the file to download
+        * output_filepath (str, path like) : destination of the file
+        * n_segments (int) : number of parallel connections. Optional,
+        default=8
+        * chunk_size (int) : size of chunks read from the response.
+        Optional, default=1 MiB
+        * headers (dict) : extra headers sent with each request. Optional
+        * session (requests.Session) : session to use. Optional, a pooled
+        session is created by default.
+    """
+
+    def __init__(self, url, output_filepath, n_segments=8,
+                 chunk_size=1024 * 1024, headers=None, session=None):
+        self.url = url
+        self.output_filepath = str(output_filepath)
+        self.state_filepath = self.output_filepath + '.state'
+        self.n_segments = max(1, int(n_segments))
+        self.chunk_size = chunk_size
+        self.headers = dict(headers or {})
+        # Ranges are byte offsets in the raw file, never in an encoded body.
+        self.headers['Accept-Encoding'] = 'identity'
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=self.n_segments)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _probe(self):
+        """Return (content_length, validator, accept_ranges) for self.url.
+
+        A one byte Range request is used rather than HEAD because some servers
+        answer HEAD differently than GET.
+        """
+        headers = dict(self.headers, Range='bytes=0-0')
+        with self.session.get(self.url, headers=headers, stream=True) as resp:
+            resp.raise_for_status()
+            validator = resp.headers.get('ETag') or \
+                resp.headers.get('Last-Modified')
+            if resp.status_code == 206:
+                content_range = resp.headers.get('Content-Range', '')
+                total = content_range.rsplit('/', 1)[-1]
+                if total.isdigit():
+                    return int(total), validator, True
+            content_length = resp.headers.get('content-length')
+            if content_length is not None:
+                content_length = int(content_length)
+            return content_length, validator, False
+
+    def _new_state(self, content_length, validator):
+        """Split [0, content_length) in n_segments contiguous ranges."""
+        size = -(-content_length // self.n_segments)
+        segments = list()
+        for start in range(0, content_length, size):
+            end = min(start + size, content_length) - 1
+            # [start, end, next byte to download]
+            segments.append([start, end, start])
+        return {'url': self.url,
+                'content_length': content_length,
+                'validator': validator,
+                'segments': segments}
+
+    def _load_state(self, content_length, validator):
+        """Reload the sidecar state if it matches the remote file."""
+        if not (os.path.exists(self.state_filepath)
+                and os.path.exists(self.output_filepath)):
+            return None
+        try:
+            with open(self.state_filepath) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            logger.warning('Unreadable state file, restarting download.')
+            return None
+        if (state.get('url') != self.url
+                or state.get('content_length') != content_length
+                or state.get('validator') != validator):
+            logger.info('Remote file changed, restarting download.')
+            return None
+        return state
+
+    def _save_state(self):
+        """Atomically write the state file. Caller must hold self._lock."""
+        tmp = self.state_filepath + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(self._state, file)
+        os.replace(tmp, self.state_filepath)
+
+    def _fetch_segment(self, index, progress):
+        """Download the remaining bytes of one segment."""
+        start, end, offset = self._state['segments'][index]
+        if offset > end:
+            return
+        headers = dict(self.headers, Range=f'bytes={offset}-{end}')
+        with self.session.get(self.url, headers=headers, stream=True) as resp:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                raise IOError('Server ignored the Range header.')
+            with open(self.output_filepath, 'r+b') as file:
+                file.seek(offset)
+                for data in resp.iter_content(chunk_size=self.chunk_size):
+                    data = data[:end + 1 - offset]
+                    file.write(data)
+                    offset += len(data)
+                    progress.update(len(data))
+                    with self._lock:
+                        self._state['segments'][index][2] = offset
+                        self._save_state()
+                    if offset > end:
+                        break
+        if offset <= end:
+            raise IOError(f'Segment {index} interrupted at byte {offset}.')
+
+    def _single_stream(self, content_length):
+        """Fallback when the server doesn't support Range requests."""
+        logger.info('Range requests not supported, using a single stream.')
+        with self.session.get(self.url, headers=self.headers,
+                              stream=True) as resp:
+            resp.raise_for_status()
+            with open(self.output_filepath, 'wb') as file, \
+                    tqdm(total=content_length, desc='Download data',
+                         unit='B', unit_scale=True) as progress:
+                for data in resp.iter_content(chunk_size=self.chunk_size):
+                    file.write(data)
+                    progress.update(len(data))
+
+    def run(self):
+        """Download the file, resuming a previous partial download."""
+        content_length, validator, accept_ranges = self._probe()
+        if not accept_ranges or not content_length:
+            self._single_stream(content_length)
+            if os.path.exists(self.state_filepath):
+                os.remove(self.state_filepath)
+            return self.output_filepath
+
+        self._state = self._load_state(content_length, validator)
+        if self._state is None:
+            self._state = self._new_state(content_length, validator)
+            with open(self.output_filepath, 'wb') as file:
+                file.truncate(content_length)
+            with self._lock:
+                self._save_state()
+        else:
+            logger.info('Resuming download from %s.', self.state_filepath)
+
+        done = sum(offset - start
+                   for start, _, offset in self._state['segments'])
+        with tqdm(total=content_length, initial=done, desc='Download data',
+                  unit='B', unit_scale=True) as progress, \
+                ThreadPoolExecutor(max_workers=self.n_segments) as executor:
+            futures = [executor.submit(self._fetch_segment, i, progress)
+                       for i in range(len(self._state['segments']))]
+            for future in futures:
+                future.result()
+
+        os.remove(self.state_filepath)
+        return self.output_filepath
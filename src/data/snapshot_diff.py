@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""SnapshotDiff: find products changed between two exports."""
+
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger(__file__)
+
+
+class SnapshotDiff(object):
+    """SnapshotDiff. Compare an export with the previous processed one.
+
+    Only a hash per product is kept from the previous export (in
+    `hashes_filepath`), so the comparison never needs the old data. The
+    result lists the product codes that are new, changed or deleted.
+
+    :usage:
+        >>> diff = SnapshotDiff('data/interim/products_hashes.pickle')
+        >>> delta = diff.compute(read_chunks('data/raw/products.csv'))
+        >>> delta['status'].value_counts()
+            changed    1250
+            new         830
+            deleted      12
+        >>> diff.save()
+
+    :args:
+        * hashes_filepath (str, path like) : file storing the hashes of the
+        previous snapshot
+        * key (str) : column identifying a product. Optional, default=code
+    """
+
+    NEW = 'new'
+    CHANGED = 'changed'
+    DELETED = 'deleted'
+
+    def __init__(self, hashes_filepath, key='code'):
+        self.hashes_filepath = str(hashes_filepath)
+        self.key = key
+        self.hashes = None
+
+    @property
+    def previous_hashes(self):
+        """Hashes of the previous snapshot (empty if there is none)."""
+        if os.path.exists(self.hashes_filepath):
+            return pd.read_pickle(self.hashes_filepath)
+        return pd.Series(dtype='uint64', name='hash')
+
+    def hash_rows(self, frame):
+        """Return a Series of row hashes indexed by product code."""
+        frame = frame.dropna(subset=[self.key])
+        hashes = pd.util.hash_pandas_object(frame.drop(columns=self.key),
+                                            index=False)
+        hashes.index = frame[self.key].values
+        hashes.name = 'hash'
+        return hashes
+
+    def compute(self, chunks):
+        """Compute the delta between the previous snapshot and `chunks`.
+
+        :args:
+            chunks (iterable of pd.DataFrame) : the new export, by chunks.
+        :return:
+            delta (pd.DataFrame) : columns `code` and `status`
+        """
+        hashes = pd.concat([self.hash_rows(chunk) for chunk in chunks])
+        hashes = hashes[~hashes.index.duplicated(keep='last')]
+        self.hashes = hashes
+        previous = self.previous_hashes
+
+        common = hashes.index.intersection(previous.index)
+        changed = common[hashes[common].values != previous[common].values]
+        new = hashes.index.difference(previous.index)
+        deleted = previous.index.difference(hashes.index)
+        delta = pd.concat([
+            pd.DataFrame({self.key: new, 'status': self.NEW}),
+            pd.DataFrame({self.key: changed, 'status': self.CHANGED}),
+            pd.DataFrame({self.key: deleted, 'status': self.DELETED}),
+        ], ignore_index=True)
+        logger.info('%i new, %i changed, %i deleted products.',
+                    len(new), len(changed), len(deleted))
+        return delta
+
+    def save(self):
+        """Store the hashes of the current snapshot for the next run."""
+        if self.hashes is None:
+            raise ValueError('Nothing to save, call compute first.')
+        self.hashes.to_pickle(self.hashes_filepath)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""stages: steps from the raw export to the data used by the demo app.
+
+Each function follows the Stage signature `func(inputs, outputs, **params)`.
+`make_pipeline` declares how they are chained.
+"""
+
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from src.data import cleaning as cleaning_rules
+from src.data import (bson_loader, data_downloader, image_fetcher,
+                      iter_stream, loaders, parquet_stream, schema,
+                      segmented_download, snapshot_diff)
+from src.data import thumbnails as thumbnail_builder
+from src.data.data_downloader import DataDownloader
+from src.data.image_fetcher import ImageFetcher
+from src.data.thumbnails import ThumbnailBuilder
+from src.data.loaders import read_chunks
+from src.data.pipeline import Pipeline, Stage
+from src.utils import normalizer, parallel, parsers, string_handler
+from src.utils.parallel import ChunkedExecutor
+from src.utils.parsers import ParseCache, UnitParser
+from src.utils.string_handler import ClusterDictionary, StringClustering
+
+logger = logging.getLogger(__file__)
+
+CLUSTERING = {'brands': 'StringFingerPrint',
+              'main_category_en': 'StringFingerPrint',
+              'pnns_groups_1': 'NGramFingerPrint',
+              'pnns_groups_2': 'NGramFingerPrint'}
+
+
+def download(inputs, outputs, frmt='csv'):
+    """Download the export in the data folder."""
+    data_dir = outputs[0].parents[1]
+    DataDownloader(data_dir, frmt=frmt, columns=schema.COLUMNS).run()
+
+
+def projection(inputs, outputs):
+    """Keep only the columns used by the project."""
+    data = schema.concat(read_chunks(inputs[0], columns=schema.COLUMNS))
+    data.to_pickle(outputs[0])
+
+
+def cleaning(inputs, outputs):
+    """Drop products without mandatory fields and fill the others."""
+    data = pd.read_pickle(inputs[0]).drop(columns='image_url')
+    data = data.dropna(subset=['nutriscore_grade', 'energy_100g',
+                               'quantity', 'main_category_en'])
+    for field in ['brands', 'pnns_groups_1']:
+        if 'unknown' not in data[field].cat.categories:
+            data[field] = data[field].cat.add_categories('unknown')
+        data[field] = data[field].fillna('unknown')
+    data = data.fillna({field: 0 for field in schema.NUTRI_FACTS[1:]})
+    data.to_pickle(outputs[0])
+
+
+def quantity_parsing(inputs, outputs, cache_filepath=None, max_workers=None):
+    """Parse the quantity column, drop products with unknown format.
+
+    The quantity is replaced by quantity_value, quantity_unit and
+    quantity_base (in grams or millilitres). Strings already parsed by a
+    previous run are read from the cache. Strings are normalized on
+    `max_workers` processes.
+    """
+    data = pd.read_pickle(inputs[0])
+    executor = ChunkedExecutor(max_workers=max_workers)
+    quantity = executor.map(normalizer.batch, data['quantity'],
+                            func=normalizer.normalize_quantity)
+    cache = ParseCache(cache_filepath) if cache_filepath else None
+    parsed = UnitParser.parse_series(quantity, cache=cache)
+    logger.info('Quantity parsing status:\n%s',
+                parsed['status'].value_counts())
+    unknown = quantity[(parsed['status'] != 'ok').to_numpy()].dropna()
+    logger.info('Most frequent unknown quantity shapes:\n%s',
+                UnitParser.shape_counts(unknown).head(10))
+    if cache is not None:
+        logger.info('Quantity parse cache: %s', cache.info())
+        cache.save()
+    parsed = parsed[parsed['status'] == 'ok']
+    data = data.loc[parsed.index].drop(columns='quantity')
+    data['quantity_value'] = parsed['value']
+    data['quantity_unit'] = parsed['unit']
+    data['quantity_base'] = parsed['base_quantity']
+    data.to_pickle(outputs[0])
+
+
+def string_clustering(inputs, outputs, column, method,
+                      dictionary_filepath=None):
+    """Cluster the values of one column.
+
+    With a dictionary_filepath, the keys of the previous runs are loaded
+    from this ClusterDictionary and only the new strings are keyed. The
+    column is a full snapshot: its occurrences replace the saved ones, so a
+    re-run on the same export gives the same dictionary.
+    """
+    series = pd.read_pickle(inputs[0])[column]
+    if dictionary_filepath:
+        dictionary = ClusterDictionary(dictionary_filepath, method=method)
+        dictionary.update(series, replace=True)
+        results = dictionary.apply(series)
+        logger.info('Cluster dictionary of %s: %s', column, dictionary.info())
+        dictionary.save()
+    else:
+        results = StringClustering(series.copy(),
+                                   method=method).get_results()
+    results.name = column
+    results.to_pickle(outputs[0])
+
+
+def consistency(inputs, outputs):
+    """Replace clustered columns and drop inconsistent nutrition facts."""
+    data = pd.read_pickle(inputs[0])
+    for filepath in inputs[1:]:
+        series = pd.read_pickle(filepath)
+        data[series.name] = series.astype('category')
+    categories = data['main_category_en']
+    data['main_category_en'] = categories.where(
+        ~categories.str.contains(':', regex=False, na=False))
+    data = data.dropna(subset=['main_category_en'])
+    rules = cleaning_rules.RuleSet()
+    data = rules.filter(data)
+    logger.info('Rejected rows per rule:\n%s', rules.report())
+    data = data.drop_duplicates('code')
+    data.to_pickle(outputs[0])
+
+
+def app_export(inputs, outputs):
+    """Add the pictures' URL to the cleaned data for the demo app."""
+    data = pd.read_pickle(inputs[0])
+    images = pd.read_pickle(inputs[1])[['code', 'image_url']]
+    data = pd.merge(data, images.drop_duplicates('code'))
+    data.to_pickle(outputs[0])
+
+
+def fetch_images(inputs, outputs, max_workers=16):
+    """Download the pictures of the products used by the demo app."""
+    urls = pd.read_pickle(inputs[0])['image_url'].dropna()
+    ImageFetcher(outputs[0].parent, max_workers=max_workers).fetch(urls)
+
+
+def thumbnails(inputs, outputs, size=(128, 128)):
+    """Create the packed thumbnails of the downloaded pictures."""
+    ThumbnailBuilder(inputs[0].parent, size=size).run()
+
+
+def make_pipeline(data_dir, frmt='csv', **kwargs):
+    """Return the Pipeline from download to the demo app's data.
+
+    :args:
+        * data_dir (str, path like) : data folder (with raw, interim and
+        processed sub folders)
+        * frmt (str) : "csv" or "parquet", format of the raw export.
+        Optional, default=csv
+        * kwargs : given to Pipeline (max_workers, processes)
+
+    :usage:
+        >>> make_pipeline('data').run()
+    """
+    data_dir = Path(data_dir)
+    raw = data_dir.joinpath('raw')
+    interim = data_dir.joinpath('interim')
+    processed = data_dir.joinpath('processed')
+    export = raw.joinpath('products.parquet' if frmt == 'parquet'
+                          else 'products.csv')
+
+    stages = [
+        Stage('download', download, outputs=[export],
+              params={'frmt': frmt},
+              code=[data_downloader, segmented_download, parquet_stream,
+                    iter_stream, bson_loader, snapshot_diff, loaders,
+                    schema],
+              always_run=True),
+        Stage('projection', projection, inputs=[export],
+              outputs=[interim.joinpath('products_interim.pickle')],
+              code=[loaders, schema]),
+        Stage('cleaning', cleaning,
+              inputs=[interim.joinpath('products_interim.pickle')],
+              outputs=[interim.joinpath('products_cleaned.pickle')],
+              code=[cleaning_rules, schema]),
+        Stage('quantity_parsing', quantity_parsing,
+              inputs=[interim.joinpath('products_cleaned.pickle')],
+              outputs=[interim.joinpath('products_quantity.pickle')],
+              params={'cache_filepath': str(interim.joinpath(
+                  'quantity_cache.pickle'))},
+              code=[parsers, normalizer, parallel]),
+    ]
+    clusters = list()
+    for column, method in CLUSTERING.items():
+        output = interim.joinpath(f'clusters_{column}.pickle')
+        clusters.append(output)
+        stages.append(Stage(
+            f'clustering_{column}', string_clustering,
+            inputs=[interim.joinpath('products_quantity.pickle')],
+            outputs=[output],
+            params={'column': column, 'method': method,
+                    'dictionary_filepath': str(interim.joinpath(
+                        f'clusters_{column}_dictionary.pickle'))},
+            code=[string_handler, normalizer]))
+    stages += [
+        Stage('consistency', consistency,
+              inputs=[interim.joinpath('products_quantity.pickle')]
+              + clusters,
+              code=[cleaning_rules],
+              outputs=[interim.joinpath('products_interimV2.pickle')]),
+        Stage('app_export', app_export,
+              inputs=[interim.joinpath('products_interimV2.pickle'),
+                      interim.joinpath('products_interim.pickle')],
+              outputs=[processed.joinpath('products.pickle')]),
+        Stage('fetch_images', fetch_images,
+              inputs=[processed.joinpath('products.pickle')],
+              outputs=[raw.joinpath('picts', 'index.json')],
+              code=[image_fetcher]),
+        Stage('thumbnails', thumbnails,
+              inputs=[raw.joinpath('picts', 'index.json')],
+              outputs=[raw.joinpath('picts', 'thumbnails.json')],
+              code=[thumbnail_builder]),
+    ]
+    return Pipeline(stages, cache_dir=data_dir.joinpath('.pipeline'),
+                    **kwargs)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""thumbnails: small versions of the downloaded product pictures."""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+logger = logging.getLogger(__file__)
+
+PACK_NAME = 'thumbnails.bin'
+PACK_INDEX_NAME = 'thumbnails.json'
+
+
+def make_thumbnail(source, destination, size):
+    """Write a `size` thumbnail of source, return it as an uint8 array.
+
+    The picture is resized keeping its aspect ratio and centered on a white
+    background so every thumbnail has exactly `size` pixels.
+    """
+    with Image.open(source) as img:
+        img = img.convert('RGB')
+        img.thumbnail(size)
+        thumbnail = Image.new('RGB', size, (255, 255, 255))
+        thumbnail.paste(img, ((size[0] - img.width) // 2,
+                              (size[1] - img.height) // 2))
+    thumbnail.save(destination, quality=85)
+    return np.asarray(thumbnail, dtype='uint8')
+
+
+def _make_thumbnail(args):
+    """Helper for the process pool: returns None if the picture is bad."""
+    try:
+        return make_thumbnail(*args)
+    except (OSError, ValueError, SyntaxError,
+            Image.DecompressionBombError) as e:
+        logger.warning('Cannot create thumbnail of %s: %s', args[0], e)
+        return None
+
+
+class ThumbnailBuilder(object):
+    """ThumbnailBuilder. Create thumbnails of the pictures' cache.
+
+    Works on the cache of ImageFetcher: a jpeg thumbnail is written in
+    `picts_dir/thumbnails` for every picture, and with `pack=True` all
+    thumbnails are also stored as raw RGB arrays in one file
+    (`thumbnails.bin`) indexed by `thumbnails.json`. Readers can memory-map
+    the pack (see ThumbnailPack) instead of decoding jpeg files. Pictures
+    are processed in parallel on all cores.
+
+    :usage:
+        >>> ThumbnailBuilder('data/raw/picts', size=(128, 128)).run()
+
+    :args:
+        * picts_dir (str, path like) : folder of the ImageFetcher cache
+        * size (tuple) : (width, height) of thumbnails. Optional,
+        default=(128, 128)
+        * pack (bool) : write the packed file. Optional, default=True
+        * max_workers (int) : number of processes. Optional,
+        default=os.cpu_count()
+    """
+
+    def __init__(self, picts_dir, size=(128, 128), pack=True,
+                 max_workers=None):
+        self.picts_dir = Path(picts_dir)
+        self.thumbnails_dir = self.picts_dir.joinpath('thumbnails')
+        self.size = tuple(size)
+        self.pack = pack
+        self.max_workers = max_workers or os.cpu_count()
+
+    def _pictures(self):
+        """Names (relative to picts_dir) of the cached pictures."""
+        with open(self.picts_dir.joinpath('index.json')) as file:
+            index = json.load(file)
+        return sorted(set(index.values()))
+
+    def thumbnail_path(self, name):
+        return self.thumbnails_dir.joinpath(Path(name).stem + '.jpg')
+
+    def run(self):
+        """Create the thumbnails.
+
+        :returns:
+            n_thumbnails (int) : number of thumbnails created.
+        """
+        self.thumbnails_dir.mkdir(parents=True, exist_ok=True)
+        names = self._pictures()
+        tasks = [(self.picts_dir.joinpath(name), self.thumbnail_path(name),
+                  self.size) for name in names]
+        pack_index = dict()
+        pack_filepath = self.picts_dir.joinpath(PACK_NAME)
+        width, height = self.size
+        pack_file = open(str(pack_filepath) + '.tmp', 'wb') if self.pack \
+            else nullcontext()
+        with pack_file as pack, \
+                ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(_make_thumbnail, tasks, chunksize=64)
+            for name, array in tqdm(zip(names, results), total=len(names),
+                                    desc='Thumbnails'):
+                if array is None:
+                    continue
+                if self.pack:
+                    pack_index[name] = len(pack_index)
+                    pack.write(array.tobytes())
+        if self.pack:
+            os.replace(str(pack_filepath) + '.tmp', pack_filepath)
+            with open(self.picts_dir.joinpath(PACK_INDEX_NAME), 'w') as file:
+                json.dump({'width': width, 'height': height,
+                           'rows': pack_index}, file)
+        return len(pack_index) if self.pack else len(names)
+
+
+class ThumbnailPack(object):
+    """ThumbnailPack. Read thumbnails from the packed file.
+
+    The pack is memory-mapped: getting a thumbnail reads only its bytes and
+    doesn't decode anything.
+
+    :usage:
+        >>> pack = ThumbnailPack('data/raw/picts')
+        >>> pack.get(url)
+            <PIL.Image.Image image mode=RGB size=128x128>
+
+    :args:
+        * picts_dir (str, path like) : folder of the ImageFetcher cache
+    """
+
+    def __init__(self, picts_dir):
+        self.picts_dir = Path(picts_dir)
+        with open(self.picts_dir.joinpath('index.json')) as file:
+            self.urls = json.load(file)
+        with open(self.picts_dir.joinpath(PACK_INDEX_NAME)) as file:
+            pack_index = json.load(file)
+        self.rows = pack_index['rows']
+        shape = (len(self.rows), pack_index['height'], pack_index['width'], 3)
+        if self.rows:
+            self.array = np.memmap(self.picts_dir.joinpath(PACK_NAME),
+                                   dtype='uint8', mode='r', shape=shape)
+        else:
+            self.array = np.empty(shape, dtype='uint8')
+
+    def get_array(self, url):
+        """Return the thumbnail as a (height, width, 3) array or None."""
+        row = self.rows.get(self.urls.get(url))
+        if row is None:
+            return None
+        return self.array[row]
+
+    def get(self, url):
+        """Return the thumbnail as a PIL.Image or None."""
+        array = self.get_array(url)
+        return None if array is None else Image.fromarray(np.asarray(array))
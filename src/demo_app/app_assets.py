@@ -7,19 +7,42 @@ from PIL import Image
 import requests
 import streamlit as st
 
+from src.data.thumbnails import ThumbnailPack
+
 BASE_PATH = Path(__file__).parents[2]
 DATA_DIR = BASE_PATH.joinpath('data', 'raw', 'picts')
 
 
+@st.cache(allow_output_mutation=True)
+def load_thumbnails():
+    """Memory-map the packed thumbnails, None if they were not built.
+
+    See src.data.thumbnails.
+    """
+    try:
+        return ThumbnailPack(DATA_DIR)
+    except (OSError, ValueError, KeyError):
+        # missing, corrupt or truncated pack: download the pictures
+        return None
+
+
 @st.cache
 def get_image(url):
-    """Download image from openfoodfacts's website.
+    """Get a product's picture.
+
+    The thumbnail is read from the packed thumbnails if it exists, otherwise
+    the image is downloaded from openfoodfacts's website.
 
     :args:
         url (str) : media's URL
     :return:
         image (PIL.Image) : downloaded picture.
     """
+    thumbnails = load_thumbnails()
+    if thumbnails is not None:
+        img = thumbnails.get(url)
+        if img is not None:
+            return img
 
     response = requests.get(url)
     if response.status_code != 200:
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""normalizer: string normalization shared by the keyers and the parsers.
+
+Translation tables are built once: ASCII strings (most of the export) are
+lowered and cleaned of punctuation by a single `str.translate`. Accents are
+removed with a folding table giving, for each character, what remains of
+its NFD decomposition once non ASCII characters are dropped. The table is
+filled in advance for Latin characters and completed when another
+character is met, so unicodedata is called once per distinct character
+instead of once per string.
+
+The results are the same as the original implementations:
+
+    * preprocess : AbstractKeyer.preprocess_string
+    * asciify : AbstractKeyer.asciify
+    * normalize_quantity : UnitParser.normalize_string
+
+:usage:
+    >>> preprocess('   Hello ! Héhé this is    a shitty example !!!')
+        'hello hehe this is a shitty example'
+    >>> batch(data['brands'], preprocess)
+"""
+
+import string
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+class FoldingTable(dict):
+    """FoldingTable. str.translate table removing accents.
+
+    Maps a code point to its NFD decomposition without the non ASCII
+    characters ('é' -> 'e', '∞' -> ''). ASCII and Latin characters are
+    computed in advance, the others are computed and stored on first use.
+    """
+
+    def __init__(self, ranges=((0, 0x250), (0x300, 0x370),
+                               (0x1e00, 0x1f00))):
+        super().__init__()
+        for start, end in ranges:
+            for code in range(start, end):
+                self[code] = self._fold(code)
+
+    @staticmethod
+    def _fold(code):
+        folded = unicodedata.normalize('NFD', chr(code))
+        return folded.encode('ascii', 'ignore').decode('utf-8')
+
+    def __missing__(self, code):
+        folded = self[code] = self._fold(code)
+        return folded
+
+
+FOLDING_TABLE = FoldingTable()
+
+# lower case and punctuation to spaces in one pass, for ASCII strings
+PREPROCESS_TABLE = str.maketrans(string.ascii_uppercase + string.punctuation,
+                                 string.ascii_lowercase
+                                 + ' ' * len(string.punctuation))
+PUNCTUATION_TABLE = str.maketrans(string.punctuation,
+                                  ' ' * len(string.punctuation))
+
+
+def asciify(s):
+    """Replace all non ASCII characters in a string.
+
+    :usage:
+        >>> asciify('é')
+            'e'
+    """
+    if s.isascii():
+        return s
+    return s.translate(FOLDING_TABLE)
+
+
+def _join_words(s):
+    """Join the fragments split on spaces, without the empty ones."""
+    return ' '.join([frag for frag in s.split(' ') if frag])
+
+
+def preprocess(s):
+    """Strip, lowerise, remove punctuation and accents in a string.
+
+    Same result as AbstractKeyer.preprocess_string.
+    """
+    s = s.strip()
+    if s.isascii():
+        return _join_words(s.translate(PREPROCESS_TABLE))
+    s = _join_words(s.lower().translate(PUNCTUATION_TABLE))
+    return s.translate(FOLDING_TABLE)
+
+
+def normalize_quantity(s):
+    """Remove non ASCII characters, strip and lowerise a string.
+
+    Same result as UnitParser.normalize_string.
+    """
+    return asciify(s).strip().lower()
+
+
+def batch(strings, func=preprocess, memo=None):
+    """Apply a normalization on many strings, each distinct one once.
+
+    :args:
+        * strings (list or pd.Series) : strings to normalize, missing values
+        are kept as they are in a Series
+        * func (callable) : normalization. Optional, default=preprocess
+        * memo (dict) : normalized strings shared between calls with the
+        same func, filled with the new ones (lists only). Optional
+    :returns:
+        normalized (list or pd.Series) : same type as strings
+    """
+    if not isinstance(strings, pd.Series):
+        cache = dict() if memo is None else memo
+        return [cache[s] if s in cache else cache.setdefault(s, func(s))
+                for s in strings]
+    codes, uniques = pd.factorize(strings.astype(object))
+    normalized = np.array([func(s) for s in uniques] + [np.nan],
+                          dtype=object)
+    return pd.Series(normalized[codes], index=strings.index,
+                     name=strings.name)
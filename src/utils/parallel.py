@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""parallel: apply a function to a column by chunks in a process pool.
+
+Chunks are sent to the workers and results sent back as Arrow IPC buffers:
+one contiguous buffer per chunk instead of pickling every python object of
+a DataFrame. Results are put back together in the order of the chunks.
+
+:usage:
+    >>> executor = ChunkedExecutor(max_workers=4)
+    >>> normalized = executor.map(apply, data['quantity'],
+                                  func=UnitParser.normalize_string)
+    >>> parsed = executor.map(UnitParser.parse_series, normalized)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__file__)
+
+
+def to_buffer(frame):
+    """Serialize a DataFrame as an Arrow IPC stream (index not kept)."""
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def from_buffer(buffer):
+    """Read a DataFrame written by to_buffer."""
+    return pa.ipc.open_stream(buffer).read_all().to_pandas()
+
+
+def apply(series, func, **kwargs):
+    """series.apply(func), usable as a module level function by the pool.
+
+    :usage:
+        >>> executor.map(apply, data['brands'], func=StringFingerPrint.key)
+    """
+    return series.apply(func, **kwargs)
+
+
+def _run_chunk(fn, buffer, kwargs):
+    """Run fn on a chunk, in a worker or in the main process."""
+    series = from_buffer(buffer)['values']
+    result = fn(series, **kwargs)
+    if isinstance(result, pd.Series):
+        return True, to_buffer(result.to_frame('values'))
+    return False, to_buffer(result)
+
+
+class ChunkedExecutor(object):
+    """ChunkedExecutor. Run a column transformation on several cores.
+
+    The series is split in chunks of `chunksize` rows, `fn(chunk, **kwargs)`
+    runs on each chunk in a process pool. fn must be defined at module level
+    (or be a class method) and return a Series or a DataFrame with one row
+    per row of the chunk, in the same order.
+
+    With max_workers=1, or a single chunk, the chunks are processed in the
+    main process going through the same Arrow conversions, so the output is
+    identical to the parallel one and can be used to check it.
+
+    :args:
+        * max_workers (int) : number of processes. Optional,
+        default=os.cpu_count()
+        * chunksize (int) : number of rows per chunk. Optional,
+        default=100 000
+    """
+
+    def __init__(self, max_workers=None, chunksize=100000):
+        self.max_workers = max_workers or os.cpu_count()
+        self.chunksize = chunksize
+
+    def _chunks(self, series):
+        values = series.reset_index(drop=True).rename('values').to_frame()
+        for start in range(0, len(values), self.chunksize):
+            yield to_buffer(values.iloc[start:start + self.chunksize])
+
+    def map(self, fn, series, **kwargs):
+        """Return fn(series, **kwargs) computed by chunks.
+
+        :args:
+            * fn (callable) : function taking a Series
+            * series (pd.Series) : data to process
+            * kwargs : given to fn
+        :returns:
+            result (pd.Series or pd.DataFrame) : results of every chunk
+            concatenated, with the index of series.
+        """
+        chunks = self._chunks(series)
+        n_chunks = -(-len(series) // self.chunksize)
+        if self.max_workers <= 1 or n_chunks <= 1:
+            results = [_run_chunk(fn, chunk, kwargs) for chunk in chunks]
+        else:
+            logger.info('%i chunks on %i processes.', n_chunks,
+                        self.max_workers)
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                results = list(pool.map(_run_chunk, [fn] * n_chunks,
+                                        chunks, [kwargs] * n_chunks))
+        if not results:
+            return fn(series.iloc[:0], **kwargs)
+        is_series = results[0][0]
+        result = pd.concat([from_buffer(buffer) for _, buffer in results],
+                           ignore_index=True)
+        if is_series:
+            result = result['values'].rename(series.name)
+        result.index = series.index
+        return result
@@ -5,10 +5,21 @@ All parsers needed for string treatment are stored in this file.
 
 """
 from abc import ABC, abstractclassmethod
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import pickle
 import re
 
-import unicodedata
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
+from src.utils import normalizer
+
+logger = logging.getLogger(__file__)
 
 mapper = {"grammes": "g",
           "gramme": "g",
@@ -60,6 +71,9 @@ mapper = {"grammes": "g",
 
 NORMAL_UNITS = ['g', 'kg', 'l', 'ml', 'cl']
 
+# factor to the base unit: grams for solids, millilitres for liquids
+BASE_FACTORS = {'g': 1., 'kg': 1000., 'l': 1000., 'ml': 1., 'cl': 10.}
+
 
 class Parser(ABC):
     """AbstractParser.
@@ -227,6 +241,204 @@ class ComplexeParser(Parser):
         return cls.choose_group(groups)
 
 
+class TokenParser(object):
+    """TokenParser. Single pass quantity parser, without exceptions.
+
+    Same results as UnitParser.parse, which stays the reference
+    implementation (see `compare`), but the string is scanned once from left
+    to right into a number, an optional multiplier ('x' or '*'), a second
+    number and a unit, instead of trying each regex and catching ValueError
+    on every failure. Strings with parentheses or commas are split into
+    their two groups the way ComplexeParser.formats would, each group is
+    scanned and the result is chosen with ComplexeParser.choose_group's
+    rules.
+
+    `parse` returns (value, unit, status), status is one of:
+
+        * OK : value and unit are set, unit is in NORMAL_UNITS
+        * UNKNOWN_FORMAT : the string doesn't look like a quantity
+        * UNKNOWN_UNIT : a quantity was found but not with a normal unit
+        * AMBIGUOUS : two groups with the same unit and different values
+
+    UnitParser.parse_series also uses MISSING for missing values.
+
+    :usage:
+        >>> TokenParser.parse('2 x 50 g')
+            (100.0, 'g', 0)
+        >>> TokenParser.parse('6 pieces')
+            (nan, nan, 2)
+    """
+
+    OK = 0
+    UNKNOWN_FORMAT = 1
+    UNKNOWN_UNIT = 2
+    AMBIGUOUS = 3
+    MISSING = 4
+    STATUSES = ['ok', 'unknown format', 'unknown unit', 'ambiguous',
+                'missing']
+
+    @staticmethod
+    def _digits(string, start):
+        """End of the run of digits starting at `start`."""
+        end = start
+        while end < len(string) and string[end].isdecimal():
+            end += 1
+        return end
+
+    @staticmethod
+    def _spaces(string, start):
+        """End of the run of whitespaces starting at `start`."""
+        end = start
+        while end < len(string) and string[end].isspace():
+            end += 1
+        return end
+
+    @staticmethod
+    def _is_unit(string):
+        """True if string is a non empty run of unit characters."""
+        if not string:
+            return False
+        for char in string:
+            if not ('a' <= char <= 'z' or char == '.' or char.isspace()):
+                return False
+        return True
+
+    @classmethod
+    def _number(cls, string, start, separator):
+        """Scan a number and the unit which follows it.
+
+        Digits, an optional decimal separator and digits, then an optional
+        `separator` and the unit, like the SimpleParser's formats.
+        Return (number, unit) as strings or None.
+        """
+        end = cls._digits(string, start)
+        if end == start:
+            return None
+        ends = [end]
+        if end < len(string) and string[end] in ',.':
+            # '100.g' keeps the dot in the number but '100.' has '.' as unit
+            ends.insert(0, cls._digits(string, end + 1))
+        for end in ends:
+            unit = string[end:]
+            if separator and unit[:1] == separator:
+                unit = unit[1:]
+            if cls._is_unit(unit):
+                return string[start:end], unit
+        return None
+
+    @classmethod
+    def _standard_unit(cls, unit):
+        unit = unit.strip()
+        return mapper.get(unit, unit)
+
+    @classmethod
+    def simple(cls, string):
+        """Scanner version of SimpleParser.parse: (value, unit) or None."""
+        # ex 100 g
+        scanned = cls._number(string, 0, separator='*')
+        if scanned is not None:
+            number, unit = scanned
+            return float(number.replace(',', '.')), cls._standard_unit(unit)
+        # ex 2 x 100 g
+        end = cls._digits(string, 0)
+        multiplier = cls._spaces(string, end)
+        if (end == 0 or multiplier == len(string)
+                or string[multiplier] not in 'x*'):
+            return None
+        scanned = cls._number(string, cls._spaces(string, multiplier + 1),
+                              separator=None)
+        if scanned is None:
+            return None
+        number, unit = scanned
+        value = float(string[:end]) * float(number.replace(',', '.'))
+        return value, cls._standard_unit(unit)
+
+    @classmethod
+    def groups(cls, string):
+        """Split string like ComplexeParser.match_regex, None if no match.
+
+        `.` doesn't match new lines and `$` matches before a final one, so
+        only a trailing new line is allowed (or new lines between the first
+        group and the parenthesis).
+        """
+        body = string[:-1] if string.endswith('\n') else string
+        # ex 100 g (2 x 50 g)
+        if body.endswith(')'):
+            inner = body[:-1]
+            newline = inner.find('\n')
+            if newline == -1:
+                bracket = inner.rfind('(', 1, len(inner) - 1)
+                if bracket != -1:
+                    return inner[:bracket], inner[bracket + 1:]
+            elif newline > 0:
+                bracket = cls._spaces(inner, newline)
+                if (bracket < len(inner) - 1 and inner[bracket] == '('
+                        and '\n' not in inner[bracket + 1:]):
+                    return inner[:newline], inner[bracket + 1:]
+        # ex 100 g, 2 x 50 g
+        if '\n' not in body:
+            comma = body.rfind(',')
+            if comma != -1:
+                return body[:comma], body[comma + 1:]
+        return None
+
+    @classmethod
+    def choose(cls, results):
+        """ComplexeParser.choose_group returning a status."""
+        if not results:
+            return np.nan, np.nan, cls.UNKNOWN_FORMAT
+        if len(results) == 1:
+            value, unit = results[0]
+        elif results[0][1] == results[1][1]:
+            if results[0][0] != results[1][0]:
+                return np.nan, np.nan, cls.AMBIGUOUS
+            value, unit = results[0]
+        elif results[0][1] in NORMAL_UNITS:
+            value, unit = results[0]
+        else:
+            value, unit = results[1]
+        if unit not in NORMAL_UNITS:
+            return np.nan, np.nan, cls.UNKNOWN_UNIT
+        return value, unit, cls.OK
+
+    @classmethod
+    def parse(cls, string):
+        """Parse a quantity, return (value, unit, status).
+
+        value and unit are NaN unless status is OK.
+        """
+        if not isinstance(string, str):
+            return np.nan, np.nan, cls.UNKNOWN_FORMAT
+        result = cls.simple(string)
+        if result is not None and result[1] in NORMAL_UNITS:
+            return result[0], result[1], cls.OK
+        groups = cls.groups(string)
+        if groups is None:
+            status = cls.UNKNOWN_FORMAT if result is None \
+                else cls.UNKNOWN_UNIT
+            return np.nan, np.nan, status
+        results = [cls.simple(group.strip()) for group in groups]
+        return cls.choose([result for result in results if result is not None])
+
+    @classmethod
+    def compare(cls, strings):
+        """Return the strings parsed differently by UnitParser.parse.
+
+        :returns:
+            differences (list) : list of (string, reference, result)
+        """
+        differences = list()
+        for string in strings:
+            reference = UnitParser.parse(string)
+            if reference != UnitParser.UNKNOWN:
+                reference = tuple(reference)
+            value, unit, status = cls.parse(string)
+            result = (value, unit) if status == cls.OK else UnitParser.UNKNOWN
+            if reference != result:
+                differences.append((string, reference, result))
+        return differences
+
+
 class UnitParser(object):
     """UnitParser
 
@@ -235,8 +447,15 @@ class UnitParser(object):
     :usage:
         >>> UnitParser.parse('100g')
             (100, 'g')
+        >>> UnitParser.parse_series(pd.Series(['1kg', '2x50 g', 'hello']))
+                value unit          status  base_quantity
+            0     1.0   kg              ok         1000.0
+            1   100.0    g              ok          100.0
+            2     NaN  NaN  unknown format            NaN
     """
 
+    UNKNOWN = 'Unknown frmt'
+
     @classmethod
     def parse(cls, text):
         try:
@@ -245,7 +464,134 @@ class UnitParser(object):
             try:
                 return cls.ensure_correct_unit(ComplexeParser.parse(text))
             except Exception:
-                return 'Unknown frmt'
+                return cls.UNKNOWN
+
+    # Strings made only of these characters are matched the same way by
+    # python's re and by RE2, the regex engine of pyarrow.compute.
+    _SAFE_CHARS = r'^[0-9a-z .,*]+$'
+    _SIMPLE_FORMATS = [
+        r'^(?P<value>\d+[,\.]?\d*)[\s*]?(?P<unit>[a-z\s\.]+)$',
+        r'^(?P<factor>\d+)\s*[x\*]{1}\s*(?P<value>\d+[\.,]?\d*)'
+        r'(?P<unit>[a-z\s\.]+)$']
+
+    @staticmethod
+    def _to_float(numbers):
+        numbers = pc.replace_substring(numbers, ',', '.')
+        return pc.cast(numbers, pa.float64())
+
+    @classmethod
+    def _extract_simple(cls, strings):
+        """Vectorized SimpleParser: return (value, unit) numpy arrays.
+
+        Apply the SimpleParser's formats (_SIMPLE_FORMATS are the same regex
+        with named groups) with pyarrow.compute, in the same order as
+        SimpleParser.match_regex. Rows without a match, or with characters
+        outside _SAFE_CHARS, get NaN and are left to the per row parser.
+        """
+        strings = np.asarray(strings, dtype=object)
+        value = np.full(len(strings), np.nan)
+        unit = np.full(len(strings), np.nan, dtype=object)
+        positions = np.flatnonzero([type(x) is str for x in strings])
+        array = pa.array(strings[positions], type=pa.string())
+        safe = pc.match_substring_regex(array, cls._SAFE_CHARS)
+        positions = positions[safe.to_numpy(zero_copy_only=False)]
+        array = array.filter(safe)
+
+        first, second = cls._SIMPLE_FORMATS
+        # struct fields by position: names need a recent pyarrow
+        extracted = pc.extract_regex(array, first)
+        values = cls._to_float(pc.struct_field(extracted, [0]))
+        units = pc.struct_field(extracted, [1])
+
+        missing = pc.is_null(extracted)
+        if pc.any(missing).as_py():
+            # ex 2 x 100 g, only for rows not matched by the first format
+            extracted = pc.extract_regex(array, second)
+            factor = pc.cast(pc.struct_field(extracted, [0]), pa.float64())
+            size = cls._to_float(pc.struct_field(extracted, [1]))
+            values = pc.if_else(missing, pc.multiply(factor, size), values)
+            units = pc.if_else(missing, pc.struct_field(extracted, [2]),
+                               units)
+
+        units = pc.utf8_trim_whitespace(units)
+        keys = pa.array(list(mapper), type=pa.string())
+        standard = pc.take(pa.array(list(mapper.values())),
+                           pc.index_in(units, value_set=keys))
+        units = pc.coalesce(standard, units)
+        value[positions] = values.to_numpy(zero_copy_only=False)
+        unit[positions] = units.to_numpy(zero_copy_only=False)
+        return value, unit
+
+    @classmethod
+    def _parse_strings(cls, strings):
+        """Parse an array of strings.
+
+        :returns:
+            (value, unit, status) numpy arrays
+        """
+        value, unit = cls._extract_simple(strings)
+        status = np.full(len(strings), TokenParser.UNKNOWN_FORMAT,
+                         dtype='int8')
+        done = np.isin(unit, NORMAL_UNITS)
+        status[done] = TokenParser.OK
+        todo = np.flatnonzero(~done)
+        value[todo] = np.nan
+        unit[todo] = np.nan
+
+        for position in todo:
+            value[position], unit[position], status[position] = \
+                TokenParser.parse(strings[position])
+        return value, unit, status
+
+    @classmethod
+    def parse_series(cls, series, cache=None):
+        """Parse a whole column of quantities.
+
+        Each distinct string is parsed once and results are broadcast back
+        to the rows. Strings matching the SimpleParser's formats with a
+        normal unit are parsed with vectorized arrow kernels, only the
+        remaining ones go through TokenParser. Values and units are the
+        same as parse applied on every row.
+
+        :args:
+            * series (pd.Series) : quantities (normalized strings)
+            * cache (ParseCache) : results of previous runs, strings found
+            in the cache are not parsed again. Optional
+        :returns:
+            result (pd.DataFrame) : with columns
+
+                * value (float) : parsed value, NaN unless status is ok
+                * unit (category) : one of NORMAL_UNITS
+                * status (category) : one of TokenParser.STATUSES
+                * base_quantity (float) : value in grams or millilitres
+        """
+        codes, uniques = pd.factorize(series.astype(object))
+        uniques = np.asarray(uniques, dtype=object)
+        if cache is None:
+            value, unit, status = cls._parse_strings(uniques)
+        else:
+            value, unit, status, missing = cache.lookup(uniques)
+            value[missing], unit[missing], status[missing] = \
+                cls._parse_strings(uniques[missing])
+            cache.update(uniques[missing], value[missing], unit[missing],
+                         status[missing])
+        unit_codes = pd.Categorical(unit, categories=NORMAL_UNITS).codes
+        factors = np.array([BASE_FACTORS[unit] for unit in NORMAL_UNITS])
+        base_quantity = value * np.append(factors, np.nan)[unit_codes]
+
+        # code -1 (missing value) takes the value appended at the end
+        def broadcast(array, missing_value):
+            return np.append(array, missing_value)[codes]
+
+        unit_codes = broadcast(unit_codes, -1)
+        status = broadcast(status, TokenParser.MISSING)
+        return pd.DataFrame({
+            'value': broadcast(value, np.nan),
+            'unit': pd.Categorical.from_codes(unit_codes, NORMAL_UNITS),
+            'status': pd.Categorical.from_codes(status,
+                                                TokenParser.STATUSES),
+            'base_quantity': broadcast(base_quantity, np.nan)},
+            index=series.index)
 
     @classmethod
     def ensure_correct_unit(cls, qty_tuple):
@@ -265,6 +611,52 @@ class UnitParser(object):
         else:
             return qty_tuple
 
+    # digits -> 9, letters -> u (except a lone x, the multiplier), spaces ->
+    # ' ', new lines -> n, other characters are kept
+    _SHAPE_TABLE = str.maketrans('0123456789abcdefghijklmnopqrstuvwyz'
+                                 '\t\r\f\v\n',
+                                 '9' * 10 + 'u' * 25 + '    n')
+    _SHAPE_RUNS = [(re.compile(r'9+'), '9'), (re.compile(r'[ux]{2,}'), 'u'),
+                   (re.compile(r' +'), ' ')]
+
+    @classmethod
+    def shape(cls, text):
+        """Return the shape signature of a quantity.
+
+        Strings with the same shape match the same SimpleParser and
+        ComplexeParser formats, only numbers and units differ.
+
+        :usage:
+            >>> UnitParser.shape('2 x 125 g')
+                '9 x 9 u'
+            >>> UnitParser.shape('500 g (4 x 125g)')
+                '9 u (9 x 9u)'
+        """
+        shape = text.translate(cls._SHAPE_TABLE)
+        for run, symbol in cls._SHAPE_RUNS:
+            shape = run.sub(symbol, shape)
+        return shape
+
+    @classmethod
+    def shape_counts(cls, strings):
+        """Return the number of strings of each shape, most frequent first.
+
+        Each distinct string is shaped once. Used to see which formats are
+        missing from the parsers, on the strings they didn't parse.
+
+        :usage:
+            >>> parsed = UnitParser.parse_series(quantity)
+            >>> UnitParser.shape_counts(quantity[parsed['status'] != 'ok'])
+                shape
+                9 u (9 u)    120
+                ...
+        """
+        counts = pd.Series(strings, dtype=object).value_counts()
+        shapes = counts.index.map(cls.shape)
+        counts = counts.groupby(shapes.to_numpy()).sum()
+        counts.index.name = 'shape'
+        return counts.sort_values(ascending=False)
+
     @classmethod
     def normalize_string(cls, string):
         """Remove non ascii characters in a string.
@@ -273,10 +665,110 @@ class UnitParser(object):
             >>> UnitParser.normalize_string("éèàâêîôûç")
                 'eeaaeiouc'
         """
-        string = unicodedata.normalize('NFD', string)
-        string = string.encode('ascii', 'ignore')
-        string = string.decode("utf-8")
-        return string.strip().lower()
+        return normalizer.normalize_quantity(string)
+
+
+def _module_version():
+    """Hash of this module's source, changes with the parsers."""
+    with open(__file__, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class ParseCache(object):
+    """ParseCache. Remember the parsed value of quantity strings.
+
+    Maps a normalized string to its (value, unit, status), see TokenParser
+    for the status codes. Used by UnitParser.parse_series so strings already
+    seen in a previous export are not parsed again. The cache keeps at most
+    `maxsize` strings, the least recently used ones are dropped first.
+
+    :usage:
+        >>> cache = ParseCache('data/interim/quantity_cache.pickle')
+        >>> UnitParser.parse_series(data['quantity'], cache=cache)
+        >>> cache.info()
+            {'size': 81250, 'maxsize': 1000000, 'hits': 80112, 'misses': 1138}
+        >>> cache.save()
+
+    :args:
+        * filepath (str, path like) : file used by load / save. Optional,
+        in memory only by default
+        * maxsize (int) : maximum number of strings. Optional,
+        default=1 000 000
+        * version (str) : version of the parsers, a saved cache with another
+        version is ignored. Optional, default=hash of this module
+    """
+
+    def __init__(self, filepath=None, maxsize=1000000, version=None):
+        self.filepath = filepath
+        self.maxsize = maxsize
+        self.version = version or _module_version()
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        if filepath is not None and os.path.exists(filepath):
+            self.load()
+
+    def __len__(self):
+        return len(self._data)
+
+    def lookup(self, strings):
+        """Return (value, unit, status, missing) arrays for strings.
+
+        `missing` is a boolean array of the strings not in the cache, their
+        value and unit are NaN.
+        """
+        value = np.full(len(strings), np.nan)
+        unit = np.full(len(strings), np.nan, dtype=object)
+        status = np.full(len(strings), TokenParser.UNKNOWN_FORMAT,
+                         dtype='int8')
+        missing = np.ones(len(strings), dtype=bool)
+        for position, text in enumerate(strings):
+            result = self._data.get(text)
+            if result is not None:
+                self._data.move_to_end(text)
+                value[position], unit[position], status[position] = result
+                missing[position] = False
+        n_missing = int(missing.sum())
+        self.misses += n_missing
+        self.hits += len(strings) - n_missing
+        return value, unit, status, missing
+
+    def update(self, strings, values, units, statuses):
+        """Add parsed strings to the cache."""
+        for text, value, unit, status in zip(strings, values, units,
+                                             statuses):
+            self._data[text] = (value, unit, int(status))
+            self._data.move_to_end(text)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def info(self):
+        """Return the size and the hit / miss counters of the cache."""
+        return {'size': len(self), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+    def load(self):
+        """Read the cache from `filepath` if it has the same version."""
+        try:
+            with open(self.filepath, 'rb') as file:
+                version, data = pickle.load(file)
+        except (OSError, ValueError, pickle.UnpicklingError) as e:
+            logger.warning('Cannot load parse cache %s: %s', self.filepath, e)
+            return
+        if version != self.version:
+            logger.info('Parse cache %s is outdated, ignored.', self.filepath)
+            return
+        self._data = data
+
+    def save(self):
+        """Write the cache in `filepath`."""
+        if self.filepath is None:
+            raise ValueError('No filepath given to the cache.')
+        tmp = str(self.filepath) + '.tmp'
+        with open(tmp, 'wb') as file:
+            pickle.dump((self.version, self._data), file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.filepath)
 
 
 # __all__ = ['UnitParser']
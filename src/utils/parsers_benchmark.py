@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""parsers_benchmark: throughput and correctness of the quantity parsers.
+
+A corpus of quantity strings is generated (same seed, same corpus) for
+several distributions, every engine parses it and its results are compared
+with UnitParser.parse, the reference. The command fails if an engine gives
+a different result, if the reference doesn't give the GOLDEN results or the
+results of the golden corpus, or if an engine is slower than in the baseline
+file.
+
+The golden corpus (parsers_golden.json.gz, next to this module) stores a
+small seeded corpus of each distribution with the results of the reference
+when it was saved, so a change of UnitParser.parse is caught even if all the
+engines change the same way. After an intended change of the parsers, check
+the differences and save it again with --save-golden.
+
+Throughputs depend on the machine, so the baseline is not versioned: save
+one with --save-baseline (`make benchmark_baseline`) before changing the
+parsers. Without a baseline file the command fails.
+
+:usage:
+    $ python src/utils/parsers_benchmark.py --save-baseline
+    $ python src/utils/parsers_benchmark.py --size 300000
+    $ python src/utils/parsers_benchmark.py --save-golden
+"""
+import gzip
+import json
+import logging
+import os
+import random
+import time
+
+import click
+import pandas as pd
+
+from src.utils.parsers import TokenParser, UnitParser, mapper
+
+logger = logging.getLogger(__file__)
+
+# examples of the parsers' documentation and their expected result
+GOLDEN = [('100g', (100.0, 'g')),
+          ('2x100g', (200.0, 'g')),
+          ('2 x 50 g', (100.0, 'g')),
+          ('2x50 g', (100.0, 'g')),
+          ('1kg', (1.0, 'kg')),
+          ('100 g (2 x 50g)', (100.0, 'g')),
+          ('500 g (4 x 125g)', (500.0, 'g')),
+          ('33 cl', (33.0, 'cl')),
+          ('1,5 l', (1.5, 'l')),
+          ('250 grammes', (250.0, 'g')),
+          ('hello', UnitParser.UNKNOWN),
+          ('6 pieces', UnitParser.UNKNOWN),
+          ('100 g (120 g)', UnitParser.UNKNOWN)]
+
+UNITS = list(mapper) + ['g', 'kg', 'l', 'ml', 'cl', 'G', 'Kg', 'L', 'CL']
+OTHER_UNITS = ['pieces', 'pièces', 'sachets', 'oeufs', 'capsules',
+               'tranches', 'portions', 'unités', 'x', 'oz', 'lb', 'fl oz']
+
+DISTRIBUTIONS = ['simple', 'complexe', 'unknown', 'mixed']
+
+BASELINE_FILEPATH = os.path.join('reports', 'benchmarks',
+                                 'parsers_baseline.json')
+
+GOLDEN_CORPUS_FILEPATH = os.path.join(os.path.dirname(__file__),
+                                      'parsers_golden.json.gz')
+GOLDEN_CORPUS_SIZE = 2000
+
+
+def _number(rng):
+    value = rng.choice([rng.randint(1, 1000), rng.randint(1, 20) * 25,
+                        rng.randint(1, 9)])
+    if rng.random() < 0.2:
+        value = f'{value}{rng.choice(",.")}{rng.randint(0, 99)}'
+    return str(value)
+
+
+def _simple(rng):
+    separator = rng.choice(['', '', ' ', '  ', '*'])
+    quantity = f'{_number(rng)}{separator}{rng.choice(UNITS)}'
+    if rng.random() < 0.3:
+        multiplier = rng.choice(['x', ' x ', 'X', ' * ', '*'])
+        quantity = f'{rng.randint(1, 24)}{multiplier}{quantity}'
+    return quantity
+
+
+def _complexe(rng):
+    first, second = _simple(rng), _simple(rng)
+    if rng.random() < 0.3:
+        # same quantity written twice, the most common case
+        second = first
+    if rng.random() < 0.7:
+        return f'{first} ({second})'
+    return f'{first}, {second}'
+
+
+def _unknown(rng):
+    return rng.choice([
+        f'{rng.randint(1, 24)} {rng.choice(OTHER_UNITS)}',
+        f'{_number(rng)} {rng.choice(OTHER_UNITS)}',
+        rng.choice(OTHER_UNITS),
+        f'{_simple(rng)} ({rng.randint(1, 12)} {rng.choice(OTHER_UNITS)})',
+        f'{_number(rng)} {_simple(rng)}',
+        f'env. {_simple(rng)}',
+        ''])
+
+
+def make_corpus(distribution, size, seed=0):
+    """Return a list of `size` normalized quantity strings.
+
+    :args:
+        * distribution (str) : one of DISTRIBUTIONS, `mixed` has realistic
+        proportions and repeats the most common strings like an export.
+        * size (int) : number of strings
+        * seed (int) : random seed. Optional, default=0
+    """
+    rng = random.Random(seed)
+    if distribution == 'mixed':
+        makers = rng.choices([_simple, _complexe, _unknown],
+                             weights=[70, 15, 15], k=size)
+        strings = [maker(rng) for maker in makers]
+        # a few strings like '500 g' or '1 l' make most of the export
+        common = [_simple(rng) for _ in range(max(1, size // 1000))]
+        for position in rng.sample(range(size), size // 2):
+            strings[position] = rng.choice(common)
+    else:
+        maker = {'simple': _simple, 'complexe': _complexe,
+                 'unknown': _unknown}[distribution]
+        strings = [maker(rng) for _ in range(size)]
+    strings += [string for string, _ in GOLDEN]
+    return [UnitParser.normalize_string(string) for string in strings]
+
+
+def _reference(strings):
+    results = list()
+    for string in strings:
+        result = UnitParser.parse(string)
+        results.append(result if result == UnitParser.UNKNOWN
+                       else tuple(result))
+    return results
+
+
+def _engine_results(parse, strings):
+    results = list()
+    for string in strings:
+        value, unit, status = parse(string)
+        results.append((value, unit) if status == TokenParser.OK
+                       else UnitParser.UNKNOWN)
+    return results
+
+
+def _series_results(strings):
+    parsed = UnitParser.parse_series(pd.Series(strings, dtype=object))
+    ok = (parsed['status'] == 'ok').to_numpy()
+    return [(value, unit) if is_ok else UnitParser.UNKNOWN
+            for value, unit, is_ok in zip(parsed['value'],
+                                          parsed['unit'].astype(object), ok)]
+
+
+ENGINES = {
+    'reference': _reference,
+    'token': lambda strings: _engine_results(TokenParser.parse, strings),
+    'series': _series_results,
+}
+
+
+def check_golden():
+    """Return the GOLDEN examples for which the reference is wrong."""
+    results = _reference([string for string, _ in GOLDEN])
+    return [(string, expected, result)
+            for (string, expected), result in zip(GOLDEN, results)
+            if result != expected]
+
+
+def save_golden_corpus(filepath=GOLDEN_CORPUS_FILEPATH,
+                       size=GOLDEN_CORPUS_SIZE):
+    """Save a corpus of each distribution with the results of the reference.
+
+    :args:
+        * filepath (str) : gzip compressed json file.
+        Optional, default=GOLDEN_CORPUS_FILEPATH
+        * size (int) : number of strings per distribution.
+        Optional, default=GOLDEN_CORPUS_SIZE
+    """
+    corpus = dict()
+    for distribution in DISTRIBUTIONS:
+        strings = make_corpus(distribution, size)
+        corpus[distribution] = [
+            [string, None, None] if result == UnitParser.UNKNOWN
+            else [string, *result]
+            for string, result in zip(strings, _reference(strings))]
+    with gzip.open(filepath, 'wt', encoding='utf-8') as file:
+        json.dump(corpus, file, ensure_ascii=False, separators=(',', ':'))
+    logger.info('Golden corpus saved in %s', filepath)
+
+
+def load_golden_corpus(filepath=GOLDEN_CORPUS_FILEPATH):
+    """Return the golden corpus.
+
+    :returns:
+        corpus (dict) : for each distribution the list of
+        (string, expected result) pairs, expected is (value, unit) or
+        UnitParser.UNKNOWN.
+    """
+    with gzip.open(filepath, 'rt', encoding='utf-8') as file:
+        corpus = json.load(file)
+    return {distribution: [(string, UnitParser.UNKNOWN if unit is None
+                            else (value, unit))
+                           for string, value, unit in rows]
+            for distribution, rows in corpus.items()}
+
+
+def check_golden_corpus(filepath=GOLDEN_CORPUS_FILEPATH):
+    """Return the strings of the golden corpus for which the reference
+    gives another result than the stored one."""
+    wrong = list()
+    for pairs in load_golden_corpus(filepath).values():
+        results = _reference([string for string, _ in pairs])
+        wrong += [(string, expected, result)
+                  for (string, expected), result in zip(pairs, results)
+                  if result != expected]
+    return wrong
+
+
+def run(size, distributions=None, engines=None, repeat=1):
+    """Run the benchmark.
+
+    :returns:
+        report (pd.DataFrame) : for each distribution and engine the
+        throughput (strings / second, best of `repeat` runs) and the number
+        of strings parsed differently from the reference.
+    """
+    rows = list()
+    for distribution in distributions or DISTRIBUTIONS:
+        strings = make_corpus(distribution, size)
+        expected = None
+        for name in engines or ENGINES:
+            timings = list()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                results = ENGINES[name](strings)
+                timings.append(time.perf_counter() - start)
+            if expected is None:
+                expected = _reference(strings) if name != 'reference' \
+                    else results
+            errors = sum(result != reference
+                         for result, reference in zip(results, expected))
+            rows.append({'distribution': distribution, 'engine': name,
+                         'strings_per_sec': len(strings) / min(timings),
+                         'errors': errors})
+            logger.info('%s / %s: %.0f strings/s, %i errors', distribution,
+                        name, rows[-1]['strings_per_sec'], errors)
+    return pd.DataFrame(rows).set_index(['distribution', 'engine'])
+
+
+def regressions(report, baseline, tolerance):
+    """Return the rows of report slower than the baseline beyond tolerance."""
+    baseline = pd.DataFrame(baseline).set_index(['distribution', 'engine'])
+    common = report.index.intersection(baseline.index)
+    minimum = baseline.loc[common, 'strings_per_sec'] * (1 - tolerance)
+    slower = report.loc[common, 'strings_per_sec'] < minimum
+    return report.loc[common][slower.to_numpy()]
+
+
+@click.command()
+@click.option('-n', '--size', type=int, default=300000,
+              help='Number of strings per distribution.')
+@click.option('-d', '--distribution', 'distributions', multiple=True,
+              type=click.Choice(DISTRIBUTIONS))
+@click.option('-e', '--engine', 'engines', multiple=True,
+              type=click.Choice(list(ENGINES)))
+@click.option('-r', '--repeat', type=int, default=1)
+@click.option('--baseline', type=click.Path(), default=BASELINE_FILEPATH,
+              help='Throughput of a previous run.')
+@click.option('--save-baseline', is_flag=True,
+              help='Write the results in the baseline file, to compare the '
+              'next runs with.')
+@click.option('--save-golden', is_flag=True,
+              help='Write the results of the reference in the golden corpus '
+              'file, after an intended change of the parsers.')
+@click.option('--tolerance', type=float, default=0.2,
+              help='Accepted slow down compared to the baseline.')
+def main(size, distributions, engines, repeat, baseline, save_baseline,
+         save_golden, tolerance):
+    """Benchmark the quantity parsers."""
+    failed = False
+    if save_golden:
+        save_golden_corpus()
+    wrong = check_golden() + check_golden_corpus()
+    for string, expected, result in wrong:
+        logger.error('UnitParser.parse(%r) = %r, expected %r', string,
+                     result, expected)
+        failed = True
+    report = run(size, distributions, engines, repeat)
+    click.echo(report.to_string(float_format='{:.0f}'.format))
+    if report['errors'].any():
+        logger.error('Some engines differ from the reference.')
+        failed = True
+    if save_baseline:
+        os.makedirs(os.path.dirname(baseline) or '.', exist_ok=True)
+        with open(baseline, 'w') as file:
+            json.dump(report.reset_index().to_dict(orient='records'), file,
+                      indent=2)
+        logger.info('Baseline saved in %s', baseline)
+    elif os.path.exists(baseline):
+        with open(baseline) as file:
+            slower = regressions(report, json.load(file), tolerance)
+        if len(slower):
+            logger.error('Slower than the baseline:\n%s', slower)
+            failed = True
+    else:
+        logger.error('No baseline file %s, throughput not checked. Save one '
+                     'with --save-baseline.', baseline)
+        failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
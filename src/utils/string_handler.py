@@ -12,14 +12,26 @@ https://github.com/OpenRefine/OpenRefine/blob/master/LICENSE.txt
 """
 
 from abc import ABC, abstractclassmethod
-import string
-
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import hashlib
+import logging
+import os
+import pickle
+import zlib
+
+import numpy as np
 import pandas as pd
-import unicodedata
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from tqdm import tqdm
 
+from src.utils import normalizer
+
 tqdm.pandas()
 
+logger = logging.getLogger(__file__)
+
 
 class AbstractKeyer(ABC):
     """AbstractKeyer class.
@@ -32,7 +44,8 @@ class AbstractKeyer(ABC):
     def preprocess_string(cls, s):
         """Preprocess string.
 
-        Strip, lowerise and remove punctuation in a string.
+        Strip, lowerise and remove punctuation in a string (see
+        src.utils.normalizer).
 
         :args:
             s (str) : string to process
@@ -46,29 +59,7 @@ class AbstractKeyer(ABC):
                 'hello hehe this is a shitty example'
 
         """
-        s = s.strip()  # first remove whitespace around the string
-        s = s.lower()  # then lowercase it
-        # then replace all punctuation and control chars by spaces
-        # we need to keep spaces for now otherwise:
-        # Carrefour,Carrefour-baby --> CarrefourCarrefourbaby instead of
-        # Carrefour, Carrefour-baby --> Carrefour Carrefour baby
-        # The translator map all punctation symbole with whitespace
-        translator = str.maketrans(string.punctuation,
-                                   ' ' * len(string.punctuation))
-        # make the translation, all punctation became a space
-        s = s.translate(translator)
-        # then split on whithespaces
-        frags = s.split(' ')
-        # drop trailing whitespaces
-        # the split on whitespaces give you a list with empty strings
-        # so drop them
-        frags = [x for x in frags if x]
-        # join all fragments back together
-        s = ' '.join(frags)
-
-        # replace non ascii chars
-        s = cls.asciify(s)
-        return s
+        return normalizer.preprocess(s)
 
     @classmethod
     def asciify(cls, s):
@@ -84,10 +75,7 @@ class AbstractKeyer(ABC):
             >>> AbstractKeyer.asciify("é")
                 'e'
         """
-        s = unicodedata.normalize('NFD', s)
-        s = s.encode('ascii', 'ignore')
-        s = s.decode('utf-8')
-        return s
+        return normalizer.asciify(s)
 
     @abstractclassmethod
     def key(cls, s):
@@ -98,6 +86,23 @@ class AbstractKeyer(ABC):
         msg = 'This method should be overriden in child class'
         raise NotImplementedError(msg)
 
+    @classmethod
+    def keys(cls, strings, memo=None, **kwargs):
+        """Keys of many strings, each distinct string is keyed once.
+
+        Used by StringClustering in place of key. Override it with a
+        vectorized or cached version when there is one.
+
+        :args:
+            * strings (iterable) : strings to process
+            * memo (dict) : preprocessed strings shared between calls, see
+            normalizer.batch. Not used by key. Optional
+            * kwargs : given to key
+        :returns:
+            keys (list) : key of each string
+        """
+        return normalizer.batch(list(strings), partial(cls.key, **kwargs))
+
 
 class StringFingerPrint(AbstractKeyer):
     """Get finger print of a string.
@@ -116,7 +121,17 @@ class StringFingerPrint(AbstractKeyer):
     @classmethod
     def key(cls, s):
         """Create a StringFingerPrint from a string. See class docs."""
-        s = cls.preprocess_string(s)
+        return cls.fingerprint(cls.preprocess_string(s))
+
+    @classmethod
+    def keys(cls, strings, memo=None):
+        """StringFingerPrint of many strings, preprocessed in one batch."""
+        return [cls.fingerprint(s)
+                for s in normalizer.batch(list(strings), memo=memo)]
+
+    @classmethod
+    def fingerprint(cls, s):
+        """Fingerprint of an already preprocessed string."""
         # split string on white spaces
         frags = s.split(' ')
         # sort fragments by alphabetical order
@@ -153,7 +168,17 @@ class NGramFingerPrint(AbstractKeyer):
     @classmethod
     def key(cls, s, ngram_size=2):
         """Create a NGramFingerPrint from a string. See class docs."""
-        s = cls.preprocess_string(s)
+        return cls.fingerprint(cls.preprocess_string(s), ngram_size)
+
+    @classmethod
+    def keys(cls, strings, ngram_size=2, memo=None):
+        """NGramFingerPrint of many strings, preprocessed in one batch."""
+        return [cls.fingerprint(s, ngram_size)
+                for s in normalizer.batch(list(strings), memo=memo)]
+
+    @classmethod
+    def fingerprint(cls, s, ngram_size=2):
+        """Fingerprint of an already preprocessed string."""
         # remove whitespace
         s = s.replace(' ', '')
         # get fragments
@@ -176,13 +201,277 @@ class NGramFingerPrint(AbstractKeyer):
             yield s[i:i + ngram_size]
 
 
+class NearestNeighbours(object):
+    """Cluster strings close to each other by edit distance.
+
+    Nearest neighbours method of OpenRefine: two strings are in the same
+    cluster when their Levenshtein distance, after preprocessing, is at most
+    `radius`. Clusters are the connected components of these pairs.
+
+    Comparing all pairs is quadratic, so candidates are blocked with an
+    inverted index of n-grams. An edit changes at most `ngram_size` n-grams,
+    so two strings within `radius` share all but `radius * ngram_size` of
+    their n-grams: it is enough to index the `radius * ngram_size + 1`
+    rarest n-grams of each string and to compare strings sharing one of
+    them. Short strings, which can be close without sharing any n-gram, are
+    also blocked on their deletion variants.
+
+    Contrary to the keyers, keys are computed on all the strings at once:
+    the key of a string is one of the strings of its cluster.
+
+    :usage:
+        >>> NearestNeighbours.keys(['Carrefour', 'Carefour', 'Auchan'])
+            ['Carefour', 'Carefour', 'Auchan']
+        >>> StringClustering(data['brands'], method='NearestNeighbours',
+                             radius=1).get_results()
+    """
+
+    @classmethod
+    def keys(cls, strings, radius=1, ngram_size=3, memo=None):
+        """Return the key of each string.
+
+        :args:
+            * strings (iterable) : strings to cluster
+            * radius (int) : maximum Levenshtein distance. Optional,
+            default=1
+            * ngram_size (int) : size of n-grams used for blocking, longer
+            n-grams give smaller blocks. Optional, default=3
+            * memo (dict) : preprocessed strings shared between calls, see
+            normalizer.batch. Optional
+        """
+        strings = list(strings)
+        string_forms = normalizer.batch(strings, memo=memo)
+        forms = dict()
+        for string, form in zip(strings, string_forms):
+            forms.setdefault(form, string)
+        parents = {form: form for form in forms}
+
+        def find(form):
+            while parents[form] != form:
+                parents[form] = parents[parents[form]]
+                form = parents[form]
+            return form
+
+        for first, second in cls.candidates(list(forms), radius, ngram_size):
+            if cls.levenshtein(first, second, radius) <= radius:
+                first, second = find(first), find(second)
+                if first != second:
+                    parents[max(first, second)] = min(first, second)
+        return [forms[find(form)] for form in string_forms]
+
+    @classmethod
+    def candidates(cls, forms, radius, ngram_size):
+        """Yield the pairs of strings sharing one of their rarest n-grams.
+
+        Two strings with at most `radius * ngram_size` distinct n-grams may
+        be close without sharing any, such strings are also blocked on the
+        strings obtained by deleting up to `radius` of their characters.
+        """
+        grams = [set(NGramFingerPrint.ngram_split(form, ngram_size))
+                 for form in forms]
+        frequency = dict()
+        for form_grams in grams:
+            for gram in form_grams:
+                frequency[gram] = frequency.get(gram, 0) + 1
+        prefix_size = radius * ngram_size + 1
+        index = dict()
+        for position, form_grams in enumerate(grams):
+            blocks = sorted(form_grams, key=lambda gram: (
+                frequency[gram], gram))[:prefix_size]
+            if len(form_grams) < prefix_size:
+                blocks += [('deletion', variant) for variant
+                           in cls.deletions(forms[position], radius)]
+            seen = set()
+            for block in blocks:
+                for other in index.setdefault(block, []):
+                    if other in seen:
+                        continue
+                    seen.add(other)
+                    # count filter: close strings share enough n-grams
+                    minimum = max(len(form_grams), len(grams[other])) \
+                        - radius * ngram_size
+                    if len(form_grams & grams[other]) >= minimum:
+                        yield forms[other], forms[position]
+                index[block].append(position)
+
+    @staticmethod
+    def deletions(form, radius):
+        """Strings obtained by deleting up to radius characters of form."""
+        variants = {form}
+        for _ in range(radius):
+            variants |= {variant[:i] + variant[i + 1:]
+                         for variant in variants
+                         for i in range(len(variant))}
+        return variants
+
+    @staticmethod
+    def levenshtein(first, second, limit):
+        """Levenshtein distance, or limit + 1 as soon as it exceeds limit."""
+        if abs(len(first) - len(second)) > limit:
+            return limit + 1
+        if len(first) > len(second):
+            first, second = second, first
+        previous = list(range(len(second) + 1))
+        for i, char in enumerate(first, 1):
+            current = [i]
+            for j, other in enumerate(second, 1):
+                current.append(min(previous[j] + 1, current[j - 1] + 1,
+                                   previous[j - 1] + (char != other)))
+            if min(current) > limit:
+                return limit + 1
+            previous = current
+        return min(previous[-1], limit + 1)
+
+
+class MinHashLSH(object):
+    """Cluster near duplicate strings with MinHash and LSH.
+
+    Probabilistic method for columns with many distinct values. Each string
+    is reduced to a MinHash signature of `bands * rows` integers computed on
+    its n-grams (see NGramFingerPrint.ngram_split): two signatures agree on
+    a position with a probability equal to the Jaccard similarity of the
+    n-grams. Signatures are cut in `bands` bands of `rows` integers, strings
+    with an identical band fall in the same bucket and are in the same
+    cluster. Strings with a similarity s share a bucket with a probability
+    1 - (1 - s ** rows) ** bands: more bands increase the recall, more rows
+    make buckets stricter and smaller.
+
+    Only the signatures are kept in memory, as uint32 (4 * bands * rows
+    bytes per distinct string). A string is only linked to its bucket if it
+    agrees with the first string of the bucket on at least `threshold` of
+    the signature: without this check, the chains of false positives of
+    short n-grams merge unrelated strings.
+
+    :usage:
+        >>> MinHashLSH.keys(['Carrefour', 'Carrefour Bio', 'Auchan'],
+                            bands=20, rows=2)
+            ['Carrefour', 'Carrefour', 'Auchan']
+        >>> StringClustering(data['brands'], method='MinHashLSH', bands=16,
+                             rows=4).get_results()
+    """
+
+    PRIME = (1 << 31) - 1
+
+    @classmethod
+    def keys(cls, strings, bands=16, rows=4, ngram_size=2, threshold=0.5,
+             seed=0, chunksize=100000, memo=None):
+        """Return the key of each string: a string of its cluster.
+
+        :args:
+            * strings (iterable) : strings to cluster
+            * bands (int) : number of LSH bands. Optional, default=16
+            * rows (int) : integers per band. Optional, default=4
+            * ngram_size (int) : size of n-grams. Optional, default=2
+            * threshold (float) : minimum estimated similarity with the
+            first string of a bucket, None to skip the check. Optional,
+            default=0.5
+            * seed (int) : seed of the hash functions. Optional, default=0
+            * chunksize (int) : strings hashed at once. Optional,
+            default=100 000
+            * memo (dict) : preprocessed strings shared between calls, see
+            normalizer.batch. Optional
+        """
+        strings = list(strings)
+        string_forms = [form.replace(' ', '') for form
+                        in normalizer.batch(strings, memo=memo)]
+        forms = dict()
+        for string, form in zip(strings, string_forms):
+            forms.setdefault(form, string)
+        signatures = cls.signatures(list(forms), bands * rows, ngram_size,
+                                    seed, chunksize)
+        representatives = cls.clusters(signatures, bands, rows, threshold)
+        names = list(forms.values())
+        form_keys = {form: names[representative] for form, representative
+                     in zip(forms, representatives)}
+        return [form_keys[form] for form in string_forms]
+
+    @classmethod
+    def signatures(cls, forms, n_hashes, ngram_size, seed=0,
+                   chunksize=100000):
+        """Return the MinHash signatures, an uint32 array (forms, n_hashes).
+        """
+        random_state = np.random.RandomState(seed)
+        a = random_state.randint(1, cls.PRIME, n_hashes).astype('uint64')
+        b = random_state.randint(0, cls.PRIME, n_hashes).astype('uint64')
+        signatures = np.empty((len(forms), n_hashes), dtype='uint32')
+        for start in range(0, len(forms), chunksize):
+            chunk = forms[start:start + chunksize]
+            hashes, lengths = list(), list()
+            for form in chunk:
+                shingles = set(NGramFingerPrint.ngram_split(form,
+                                                            ngram_size))
+                shingles = shingles or {form}
+                hashes.extend(zlib.crc32(shingle.encode('utf-8'))
+                              for shingle in shingles)
+                lengths.append(len(shingles))
+            hashes = np.array(hashes, dtype='uint64') % cls.PRIME
+            offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            for i in range(n_hashes):
+                permuted = (a[i] * hashes + b[i]) % cls.PRIME
+                signatures[start:start + len(chunk), i] = \
+                    np.minimum.reduceat(permuted, offsets)
+        return signatures
+
+    @staticmethod
+    def clusters(signatures, bands, rows, threshold=None):
+        """Return, for each signature, the index of its cluster's first one.
+        """
+        n_signatures = len(signatures)
+        positions = np.arange(n_signatures)
+        links = list()
+        for band in range(bands):
+            block = np.ascontiguousarray(
+                signatures[:, band * rows:(band + 1) * rows])
+            buckets = block.view(np.dtype((np.void, block.itemsize * rows)))
+            _, first, inverse = np.unique(buckets.ravel(), return_index=True,
+                                          return_inverse=True)
+            leaders = first[inverse.ravel()]
+            linked = leaders != positions
+            if threshold is not None:
+                agreement = (signatures[linked]
+                             == signatures[leaders[linked]]).mean(axis=1)
+                linked[linked] = agreement >= threshold
+            links.append((positions[linked], leaders[linked]))
+        sources = np.concatenate([source for source, _ in links])
+        targets = np.concatenate([target for _, target in links])
+        graph = coo_matrix((np.ones(len(sources), dtype='int8'),
+                            (sources, targets)),
+                           shape=(n_signatures, n_signatures))
+        _, labels = connected_components(graph, directed=False)
+        _, first_members = np.unique(labels, return_index=True)
+        return first_members[labels]
+
+
+def batch_keys(series, keyer, **kwargs):
+    """Keys of a Series with its keyer's batch method, for ChunkedExecutor.
+    """
+    if hasattr(keyer, 'keys'):
+        keys = keyer.keys(series, **kwargs)
+    else:
+        keys = [keyer.key(s, **kwargs) for s in series]
+    return pd.Series(keys, index=series.index, dtype=object)
+
+
 class StringClustering(object):
     """StringClustering.
 
     Create cluster of string following different methods.
 
     :args:
-        series (pd.Series) : pandas series contening strings to process
+        * series (pd.Series) : pandas series contening strings to process
+        * method (str) : one of StringClustering.methods
+        * executor (ChunkedExecutor) : compute the keys on several
+        processes, for the keyers with a per string `key`. Optional
+        * memo (dict) : preprocessed strings shared with other
+        clusterings, given to the keyer's `keys`. Optional
+        * kwargs : given to the key method
+
+    Methods are the keyers of the registry StringClustering.keyers. A
+    keyer is a class with a `keys(strings, **kwargs)` class method, giving
+    the keys of many strings at once, or only a `key(s, **kwargs)` class
+    method; `keys` is used when there is one and must accept a `memo`
+    keyword when StringClustering gets one. Other keyers can be added with
+    StringClustering.register.
 
     :usage:
         >>> data = pd.Series(['Abc', 'Abc', 'Aabc'])
@@ -194,32 +483,63 @@ class StringClustering(object):
          Total classes detected 1.
          Original dataset contains 2 classes
          There is 0 orphans.
-        Create a mapper function this can take a while.
-        100%|███████████████████████████████████| 1/1 [00:00<00:00, 329.25it/s]
         Replace fingerprint by original name.
-        100%|██████████████████████████████████| 3/3 [00:00<00:00, 3711.77it/s]
         0    Abc
         1    Abc
         2    Abc
-
-        Name: key, dtype: object
+        Name: key, dtype: category
+        Categories (1, object): ['Abc']
 
     """
 
-    methods = [
-        'StringFingerPrint',
-        'NGramFingerPrint'
-    ]
+    keyers = {
+        'StringFingerPrint': StringFingerPrint,
+        'NGramFingerPrint': NGramFingerPrint,
+        'NearestNeighbours': NearestNeighbours,
+        'MinHashLSH': MinHashLSH
+    }
+
+    methods = list(keyers)
 
-    def __init__(self, series, method="StringFingerPrint", **kwargs):
+    def __init__(self, series, method="StringFingerPrint", executor=None,
+                 memo=None, **kwargs):
         self.series = series
         self.kwargs = kwargs
+        self.executor = executor
+        self.memo = memo
         self.original_name = 'original_strings'
         self.series.name = self.original_name
         self.method = method
         self._data = pd.DataFrame(series)
         self._orphans = None
         self._clusters = None
+        self._cluster_names = None
+
+    @classmethod
+    def register(cls, keyer, name=None):
+        """Make a keyer available as a clustering method.
+
+        Can be used as a class decorator.
+
+        :args:
+            * keyer (class) : class with a `keys` or a `key` class method
+            * name (str) : name of the method. Optional, default is the
+            class name
+        :usage:
+            >>> @StringClustering.register
+            ... class FirstWord(AbstractKeyer):
+            ...     @classmethod
+            ...     def key(cls, s):
+            ...         return cls.preprocess_string(s).split(' ')[0]
+            >>> StringClustering(data['brands'], method='FirstWord')
+        """
+        if not (hasattr(keyer, 'keys') or hasattr(keyer, 'key')):
+            raise TypeError('A keyer must have a keys or a key method.')
+        name = name or keyer.__name__
+        cls.keyers[name] = keyer
+        if name not in cls.methods:
+            cls.methods.append(name)
+        return keyer
 
     @property
     def series(self):
@@ -233,7 +553,7 @@ class StringClustering(object):
 
     @property
     def method(self):
-        return self._method.split('.')[0]
+        return self._method
 
     @method.setter
     def method(self, method):
@@ -243,7 +563,11 @@ class StringClustering(object):
         if method == 'NGramFingerPrint' and not self.kwargs.get('ngram_size'):
             print('ngram_size not specified. Using default value [2]')
 
-        self._method = method + ".key"
+        self._method = method
+
+    @property
+    def keyer(self):
+        return self.keyers[self._method]
 
     @property
     def keys(self):
@@ -256,11 +580,30 @@ class StringClustering(object):
     def compute_keys(self):
         """Compute keys.
 
-        we apply the selected method on original data to get a new column
-        contening keys.
+        we apply the selected method on the distinct original strings only
+        and expand the keys back to every row with the factorized codes.
+        The `key` column is categorical: one code per row instead of one
+        string.
         """
-        self._data['key'] = self._data[self.original_name]\
-            .apply(eval(self._method), **self.kwargs)
+        codes, uniques = pd.factorize(self._data[self.original_name])
+        uniques = pd.Series(uniques)
+        keyer = self.keyer
+        if self.executor is not None and hasattr(keyer, 'key'):
+            # a key only depends on its string: chunks can be split
+            keys = self.executor.map(batch_keys, uniques, keyer=keyer,
+                                     **self.kwargs)
+        elif hasattr(keyer, 'keys'):
+            kwargs = dict(self.kwargs)
+            if self.memo is not None:
+                kwargs['memo'] = self.memo
+            keys = pd.Series(keyer.keys(uniques, **kwargs))
+        else:
+            keys = uniques.apply(keyer.key, **self.kwargs)
+        key_codes, key_uniques = pd.factorize(keys)
+        # missing original strings (code -1) get a missing key
+        key_codes = np.append(key_codes, -1)[codes]
+        self._data['key'] = pd.Categorical.from_codes(key_codes,
+                                                      categories=key_uniques)
 
     @property
     def orphans(self):
@@ -278,6 +621,35 @@ class StringClustering(object):
             self._clusters = count[count > 1]
         return self._clusters
 
+    @staticmethod
+    def resolve_names(keys, originals):
+        """Most frequent original string of each key.
+
+        One grouped count of the (key, original) pairs. When several
+        originals have the same count, the first one in the data is chosen.
+
+        :args:
+            * keys (pd.Series) : key of each row
+            * originals (pd.Series) : original string of each row
+        :returns:
+            names (pd.Series) : cluster name indexed by key
+        """
+        frame = pd.DataFrame({'key': keys.to_numpy(),
+                              'name': originals.to_numpy()})
+        counts = frame.groupby(['key', 'name'], sort=False).size()
+        counts = counts.sort_values(ascending=False, kind='stable')
+        keys = counts.index.get_level_values('key')
+        best = counts.index[~keys.duplicated()]
+        return pd.Series(best.get_level_values('name'),
+                         index=best.get_level_values('key'))
+
+    @property
+    def cluster_names(self):
+        if type(self._cluster_names) != pd.Series:
+            self._cluster_names = self.resolve_names(
+                self.keys, self._data[self.original_name])
+        return self._cluster_names
+
     def get_cluster_name(self, key):
         """get_cluster_name, return the name of a cluster.
 
@@ -291,45 +663,277 @@ class StringClustering(object):
             >>> clusters = StringClustering(data,
                                             method='NGramFingerPrint',
                                             ngram_size=1)
-            >>> clusters.get_cluster_name('Abc')
+            >>> clusters.get_cluster_name('abc')
                 'Abc'
         """
-        original_names = self._data[self.keys == key]
-        original_names = original_names[self.original_name].value_counts()
-        return original_names.idxmax()
+        return self.cluster_names[key]
 
     def mapper(self):
         """mapper, return a mapper function to replace wrong categories."""
-        mapp = dict()
-        for cluster in tqdm(self.clusters.index):
-            mapp[cluster] = self.get_cluster_name(cluster)
+        mapp = self.cluster_names[self.clusters.index].to_dict()
         return lambda x: mapp[x]
 
-    def clustering_result(self):
-        origin_class = self._data[self.original_name].drop_duplicates().count()
-        n_clusters = self.clusters.count()
-        n_orphans = self.orphans.count()
-        n_classes = self.keys.drop_duplicates().count()
-        print(f'Detected {n_clusters} clusters with {self.method} \n',
-              f'Total classes detected {n_classes}.\n',
-              f'Original dataset contains {origin_class} classes\n',
-              f'There is {n_orphans} orphans.')
+    def stats(self):
+        """Return the numbers printed by clustering_result, as a dict."""
+        return {
+            'method': self.method,
+            'clusters': self.clusters.count(),
+            'classes': self.keys.drop_duplicates().count(),
+            'original_classes':
+                self._data[self.original_name].drop_duplicates().count(),
+            'orphans': self.orphans.count()}
 
-    def get_results(self):
+    def clustering_result(self):
+        stats = self.stats()
+        print(f'Detected {stats["clusters"]} clusters with {self.method} \n',
+              f'Total classes detected {stats["classes"]}.\n',
+              f'Original dataset contains {stats["original_classes"]} '
+              'classes\n',
+              f'There is {stats["orphans"]} orphans.')
+
+    def get_results(self, verbose=True):
         """Results of the clustering.
 
         This is the top level API. Normally this should be the only method
         to use.
 
+        :args:
+            verbose (bool) : print the clustering results. Optional,
+            default=True
+        :returns:
+            results (pd.Series) : categorical, the cluster name of each row.
         """
-        self.clustering_result()
-        print("Create a mapper function this can take a while.")
-        mapper = self.mapper()
-        data = self._data.set_index(self._data['key'])
-        data.loc[self.orphans.index, "key"] = data.loc[self.orphans.index,
-                                                       self.original_name]
-        print("Replace fingerprint by original name.")
-        data.loc[self.clusters.index, "key"] =\
-            data.loc[self.clusters.index, "key"].progress_apply(mapper)
-        data.set_index(self.series.index, inplace=True, drop=True)
-        return data["key"]
+        if verbose:
+            self.clustering_result()
+            print("Replace fingerprint by original name.")
+        results = self.keys.map(self.cluster_names)
+        results.index = self.series.index
+        return results
+
+
+class ColumnsClustering(object):
+    """ColumnsClustering. Cluster several columns in one call.
+
+    One StringClustering per column, run concurrently in a thread pool.
+    The columns share one memo of preprocessed strings: a value found in
+    several columns is normalized once.
+
+    :usage:
+        >>> clustering = ColumnsClustering(
+                data, {'brands': 'StringFingerPrint',
+                       'main_category_en': 'StringFingerPrint',
+                       'pnns_groups_1': ('NGramFingerPrint',
+                                         {'ngram_size': 2})})
+        >>> cleaned = clustering.get_results()
+        >>> clustering.stats
+                              method  clusters  classes  original_classes ...
+            brands  StringFingerPrint      4127    51203             58012 ...
+
+    :args:
+        * data (pd.DataFrame) : data containing the columns
+        * methods (dict) : for each column, a method of
+        StringClustering.methods or a (method, kwargs) tuple
+        * max_workers (int) : number of threads. Optional, default=number
+        of columns
+        * memo (dict) : preprocessed strings, shared with other calls.
+        Optional
+    """
+
+    def __init__(self, data, methods, max_workers=None, memo=None):
+        self.data = data
+        self.methods = {column: method if isinstance(method, tuple)
+                        else (method, dict())
+                        for column, method in methods.items()}
+        self.max_workers = max_workers or max(1, len(self.methods))
+        self.memo = dict() if memo is None else memo
+        self.clusterings = dict()
+        self.stats = None
+
+    def _cluster(self, column):
+        method, kwargs = self.methods[column]
+        clustering = StringClustering(self.data[column].copy(),
+                                      method=method, memo=self.memo,
+                                      **kwargs)
+        return clustering, clustering.get_results(verbose=False)
+
+    def get_results(self):
+        """Results of the clustering of every column.
+
+        :returns:
+            results (pd.DataFrame) : categorical columns, the cluster name
+            of each row; the numbers of each column are in `stats`.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = dict(zip(self.methods,
+                               executor.map(self._cluster, self.methods)))
+        columns = dict()
+        for column, (clustering, result) in results.items():
+            self.clusterings[column] = clustering
+            columns[column] = result.rename(column)
+        self.stats = pd.DataFrame.from_dict(
+            {column: clustering.stats()
+             for column, clustering in self.clusterings.items()},
+            orient='index')
+        logger.info('Clustering results:\n%s', self.stats)
+        return pd.DataFrame(columns, index=self.data.index)
+
+
+def _module_version():
+    """Hash of this module's source, changes with the keyers."""
+    with open(__file__, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class ClusterDictionary(object):
+    """ClusterDictionary. Remember the clusters of a column between runs.
+
+    Maps every original string met so far to its key, and every key to the
+    occurrences of its original strings; the canonical name of a cluster is
+    its most frequent original string (the first one met on a tie), like
+    StringClustering.resolve_names. `update` only computes the keys of the
+    strings never seen before, adds the occurrences of the batch and
+    resolves again the names of the clusters it touched. Occurrences add
+    up over the batches of new rows; with `replace=True` the series is a
+    full snapshot of the column and its occurrences replace the previous
+    ones, so updating again with the same snapshot changes nothing. `apply`
+    is a single map of the column.
+
+    Only keyers whose key depends on the string alone can be used, not the
+    methods clustering all the strings at once (NearestNeighbours,
+    MinHashLSH).
+
+    :usage:
+        >>> dictionary = ClusterDictionary(
+                'data/interim/clusters_brands_dictionary.pickle')
+        >>> dictionary.update(data['brands'], replace=True)
+        >>> data['brands'] = dictionary.apply(data['brands'])
+        >>> dictionary.info()
+            {'strings': 61232, 'clusters': 52874, 'new_strings': 312,
+             'touched_clusters': 2904}
+        >>> dictionary.save()
+
+    :args:
+        * filepath (str, path like) : file used by load / save. Optional,
+        in memory only by default
+        * method (str) : one of StringClustering.methods. Optional,
+        default=StringFingerPrint
+        * version (str) : version of the keyers, a saved dictionary with
+        another version, method or kwargs is ignored. Optional,
+        default=hash of this module
+        * kwargs : given to the key method
+    """
+
+    def __init__(self, filepath=None, method='StringFingerPrint',
+                 version=None, **kwargs):
+        keyer = StringClustering.keyers.get(method)
+        if keyer is None or not hasattr(keyer, 'key'):
+            raise ValueError(f'{method} is not a keyer with a key method.')
+        self.filepath = filepath
+        self.method = method
+        self.keyer = keyer
+        self.kwargs = kwargs
+        self.version = version or _module_version()
+        self.string_keys = dict()
+        self.occurrences = dict()
+        self.names = dict()
+        self.mapping = dict()
+        self.new_strings = 0
+        self.touched_clusters = 0
+        if filepath is not None and os.path.exists(filepath):
+            self.load()
+
+    def __len__(self):
+        return len(self.occurrences)
+
+    def update(self, series, replace=False):
+        """Add the strings of a column to the dictionary.
+
+        :args:
+            * series (pd.Series) : original strings, missing values ignored
+            * replace (bool) : series is a full snapshot, its occurrences
+            replace the ones of the previous updates. The keys already
+            computed are kept. Optional, default=False
+        """
+        # as objects, categories are numbered in order of first appearance
+        codes, uniques = pd.factorize(series.astype(object))
+        counts = pd.Series(np.bincount(codes[codes >= 0],
+                                       minlength=len(uniques)),
+                           index=uniques)
+        unseen = [string for string in counts.index
+                  if string not in self.string_keys]
+        if unseen:
+            keys = self.keyer.keys(unseen, **self.kwargs) \
+                if hasattr(self.keyer, 'keys') \
+                else [self.keyer.key(string, **self.kwargs)
+                      for string in unseen]
+            self.string_keys.update(zip(unseen, keys))
+        if replace:
+            self.occurrences = dict()
+            self.names = dict()
+            self.mapping = dict()
+        touched = dict()
+        for string, count in counts.items():
+            key = self.string_keys[string]
+            strings = self.occurrences.setdefault(key, dict())
+            strings[string] = strings.get(string, 0) + int(count)
+            touched[key] = strings
+        for key, strings in touched.items():
+            # max keeps the first string met on a tie
+            name = max(strings, key=strings.get)
+            self.names[key] = name
+            self.mapping.update(dict.fromkeys(strings, name))
+        self.new_strings = len(unseen)
+        self.touched_clusters = len(touched)
+        logger.info('%i new strings, %i clusters touched.', len(unseen),
+                    len(touched))
+
+    def apply(self, series):
+        """Return the canonical names of a column, as a categorical.
+
+        Strings without occurrences in the dictionary (never given to
+        update, or not in the last snapshot) get a missing value.
+        """
+        results = series.map(self.mapping)
+        return results.astype('category')
+
+    def info(self):
+        """Return the size of the dictionary and of the last update."""
+        return {'strings': len(self.string_keys), 'clusters': len(self),
+                'new_strings': self.new_strings,
+                'touched_clusters': self.touched_clusters}
+
+    def _signature(self):
+        return (self.version, self.method, sorted(self.kwargs.items()))
+
+    def load(self):
+        """Read the dictionary from `filepath` if it has the same version."""
+        try:
+            with open(self.filepath, 'rb') as file:
+                signature, data = pickle.load(file)
+        except (OSError, ValueError, pickle.UnpicklingError) as e:
+            logger.warning('Cannot load cluster dictionary %s: %s',
+                           self.filepath, e)
+            return
+        if signature != self._signature():
+            logger.info('Cluster dictionary %s is outdated, ignored.',
+                        self.filepath)
+            return
+        self.string_keys, self.occurrences = data
+        self.names = {key: max(strings, key=strings.get)
+                      for key, strings in self.occurrences.items()}
+        # strings absent from the last replace=True update keep their key
+        # but have no cluster name until they are seen again
+        self.mapping = {string: self.names[key]
+                        for string, key in self.string_keys.items()
+                        if key in self.names}
+
+    def save(self):
+        """Write the dictionary in `filepath`."""
+        if self.filepath is None:
+            raise ValueError('No filepath given to the dictionary.')
+        tmp = str(self.filepath) + '.tmp'
+        with open(tmp, 'wb') as file:
+            pickle.dump((self._signature(),
+                         (self.string_keys, self.occurrences)), file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.filepath)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Tests of DataDownloader against a local HTTP server."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+
+import pytest
+
+from src.data import schema
+from src.data.data_downloader import DataDownloader
+
+EXPORT = ('\t'.join(schema.COLUMNS) + '\n'
+          + '\t'.join(['1'] * len(schema.COLUMNS)) + '\n').encode('utf-8')
+ETAG = '"v1"'
+
+
+class ExportHandler(BaseHTTPRequestHandler):
+    """Serve EXPORT with an ETag, answer 304 to a matching If-None-Match."""
+
+    requests = list()
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(EXPORT)))
+        self.end_headers()
+        self.wfile.write(EXPORT)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def export_url(monkeypatch):
+    ExportHandler.requests = list()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ExportHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_port}/products.csv'
+    monkeypatch.setattr(DataDownloader, 'CSV_URL', url)
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_not_modified_skips_download(tmp_path, export_url):
+    downloader = DataDownloader(tmp_path, frmt='csv', n_segments=2)
+    assert downloader.run()
+    assert not downloader.run()
+    assert ExportHandler.requests[-1].get('If-None-Match') == ETAG
+
+
+def test_missing_export_is_downloaded_again(tmp_path, export_url):
+    downloader = DataDownloader(tmp_path, frmt='csv', n_segments=2)
+    assert downloader.run()
+    os.remove(downloader.output_filepath)
+    n_requests = len(ExportHandler.requests)
+    assert downloader.run()
+    assert 'If-None-Match' not in ExportHandler.requests[n_requests]
+    with open(downloader.output_filepath, 'rb') as file:
+        assert file.read() == EXPORT
+
+
+def test_partial_export_is_downloaded_again(tmp_path, export_url):
+    downloader = DataDownloader(tmp_path, frmt='csv', n_segments=2)
+    assert downloader.run()
+    # left by an interrupted SegmentedDownload
+    with open(downloader.output_filepath, 'wb') as file:
+        file.write(EXPORT[:10])
+    with open(downloader.output_filepath + '.state', 'w') as file:
+        file.write('{}')
+    assert not downloader.local_export_exists()
+    assert downloader.run()
+    assert downloader.local_export_exists()
+    with open(downloader.output_filepath, 'rb') as file:
+        assert file.read() == EXPORT
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Tests of ImageFetcher against a local HTTP server."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+import pytest
+import requests
+
+from src.data.image_fetcher import ImageFetcher
+
+
+class PictureHandler(BaseHTTPRequestHandler):
+    """Serve /<name>.jpg as the bytes of name, 404 for /missing.jpg."""
+
+    requests = list()
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path == '/missing.jpg':
+            self.send_error(404)
+            return
+        content = self.path.split('/')[-1].split('.')[0].encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class InterruptingSession(requests.Session):
+    """Session raising KeyboardInterrupt on URL ending with stop.jpg."""
+
+    def get(self, url, **kwargs):
+        if url.endswith('stop.jpg'):
+            raise KeyboardInterrupt
+        return super().get(url, **kwargs)
+
+
+@pytest.fixture
+def base_url():
+    PictureHandler.requests = list()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PictureHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch(tmp_path, base_url):
+    urls = [f'{base_url}/a.jpg', f'{base_url}/b.jpg', f'{base_url}/a.jpg',
+            f'{base_url}/missing.jpg']
+    fetcher = ImageFetcher(tmp_path, max_workers=2)
+    assert fetcher.fetch(urls) == 1
+    assert fetcher.get(urls[0]).read_bytes() == b'a'
+    assert fetcher.get(urls[3]) is None
+    with open(tmp_path.joinpath('failures.json')) as file:
+        assert list(json.load(file)) == [urls[3]]
+    n_requests = len(PictureHandler.requests)
+    assert ImageFetcher(tmp_path).fetch(urls[:3]) == 0
+    assert len(PictureHandler.requests) == n_requests
+
+
+def test_index_saved_periodically(tmp_path, base_url):
+    fetcher = ImageFetcher(tmp_path, max_workers=1, save_every=2)
+    saves = list()
+    save = fetcher.save
+    fetcher.save = lambda: saves.append(len(fetcher.index)) or save()
+    fetcher.fetch([f'{base_url}/{name}.jpg' for name in 'abcde'])
+    assert saves == [2, 4, 5]
+
+
+def test_interrupted_fetch_keeps_index(tmp_path, base_url):
+    urls = [f'{base_url}/{name}.jpg' for name in ['a', 'b', 'c', 'stop']]
+    fetcher = ImageFetcher(tmp_path, max_workers=1,
+                           session=InterruptingSession())
+    with pytest.raises(KeyboardInterrupt):
+        fetcher.fetch(urls)
+    with open(tmp_path.joinpath('index.json')) as file:
+        saved = json.load(file)
+    assert saved == fetcher.index
+    assert urls[-1] not in saved
+    n_requests = len(PictureHandler.requests)
+    assert ImageFetcher(tmp_path).fetch(urls[:-1]) == 0
+    assert len(PictureHandler.requests) == n_requests + 3 - len(saved)
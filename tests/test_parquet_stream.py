@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""Tests of ParquetStreamWriter."""
+
+import io
+import math
+
+from src.data.loaders import read_chunks
+from src.data.parquet_stream import ParquetStreamWriter
+
+COLUMNS = ['code', 'brands', 'energy_100g', 'fat_100g']
+
+
+def test_invalid_numbers_become_null(tmp_path):
+    text = ('code\tbrands\tenergy_100g\tfat_100g\n'
+            '1\tA\t12.5\t1\n'
+            '2\tB\tabc\t\n'
+            '3\tA\t1e3\t2,5\n')
+    output = tmp_path.joinpath('products.parquet')
+    writer = ParquetStreamWriter(output, columns=COLUMNS)
+    assert writer.write_stream(io.BytesIO(text.encode('utf-8'))) == 3
+    data = next(read_chunks(output, columns=COLUMNS))
+    assert data['energy_100g'].tolist()[0] == 12.5
+    assert math.isnan(data['energy_100g'].tolist()[1])
+    assert data['energy_100g'].tolist()[2] == 1000.0
+    assert math.isnan(data['fat_100g'].tolist()[2])
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""Tests of the quantity parsers against the stored golden results."""
+
+import pytest
+
+from src.utils.parsers_benchmark import (DISTRIBUTIONS, ENGINES, GOLDEN,
+                                         _reference, check_golden,
+                                         check_golden_corpus, make_corpus)
+
+
+def test_golden_examples():
+    assert check_golden() == []
+
+
+def test_golden_corpus():
+    assert check_golden_corpus() == []
+
+
+@pytest.mark.parametrize('distribution', DISTRIBUTIONS)
+@pytest.mark.parametrize('engine', [name for name in ENGINES
+                                    if name != 'reference'])
+def test_engine_matches_reference(distribution, engine):
+    strings = make_corpus(distribution, 2000, seed=1)
+    assert ENGINES[engine](strings) == _reference(strings)
+
+
+def test_engines_on_golden_examples():
+    strings = [string for string, _ in GOLDEN]
+    expected = [result for _, result in GOLDEN]
+    for name in ENGINES:
+        assert ENGINES[name](strings) == expected
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Tests of SegmentedDownload against a local HTTP server."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import random
+import threading
+
+import pytest
+
+from src.data.segmented_download import SegmentedDownload
+
+CONTENT = bytes(random.Random(0).getrandbits(8) for _ in range(100000))
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve CONTENT, with Range support if `ranges` is True.
+
+    A range starting at an offset of `truncate` is cut after the given
+    number of bytes, once, like a dropped connection.
+    """
+
+    ranges = True
+    truncate = dict()
+    requests = list()
+
+    def do_GET(self):
+        header = self.headers.get('Range')
+        self.requests.append(header)
+        if not (self.ranges and header):
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(CONTENT)))
+            self.end_headers()
+            self.wfile.write(CONTENT)
+            return
+        start, end = (int(bound) for bound in header[6:].split('-'))
+        body = CONTENT[start:end + 1]
+        self.send_response(206)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Range',
+                         f'bytes {start}-{end}/{len(CONTENT)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body[:self.truncate.pop(start, len(body))])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    RangeHandler.ranges = True
+    RangeHandler.truncate = dict()
+    RangeHandler.requests = list()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/products.csv'
+    server.shutdown()
+    server.server_close()
+
+
+def test_interrupted_segment_resumes(tmp_path, url):
+    output = tmp_path.joinpath('products.csv')
+    # second segment of 25 000 bytes stops after 10 000
+    RangeHandler.truncate = {25000: 10000}
+    download = SegmentedDownload(url, output, n_segments=4, chunk_size=1024)
+    with pytest.raises(IOError):
+        download.run()
+    assert os.path.exists(download.state_filepath)
+
+    RangeHandler.requests = list()
+    SegmentedDownload(url, output, n_segments=4, chunk_size=1024).run()
+    assert output.read_bytes() == CONTENT
+    assert not os.path.exists(download.state_filepath)
+    resumed = [header for header in RangeHandler.requests
+               if header != 'bytes=0-0']
+    assert len(resumed) == 1
+    # restarted after the bytes already written, not from the segment start
+    assert 25000 < int(resumed[0][6:].split('-')[0]) <= 35000
+
+
+def test_no_range_fallback(tmp_path, url):
+    RangeHandler.ranges = False
+    output = tmp_path.joinpath('products.csv')
+    download = SegmentedDownload(url, output, n_segments=4, chunk_size=1024)
+    download.run()
+    assert output.read_bytes() == CONTENT
+    assert not os.path.exists(download.state_filepath)
+    assert len(RangeHandler.requests) == 2
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Tests of the cluster dictionary."""
+
+import pandas as pd
+
+from src.utils.string_handler import ClusterDictionary, StringClustering
+
+BRANDS = ['zeta', 'Zeta', 'nestle', 'Nestle', 'Auchan', None, 'auchan',
+          'Auchan']
+
+
+def clustering_results(series):
+    results = StringClustering(series.copy()).get_results(verbose=False)
+    return results.astype(object).tolist()
+
+
+def test_categorical_ties_first_met():
+    series = pd.Series(BRANDS, dtype='category')
+    dictionary = ClusterDictionary()
+    dictionary.update(series)
+    results = dictionary.apply(series).astype(object).tolist()
+    assert results == clustering_results(series)
+    assert results[:4] == ['zeta', 'zeta', 'nestle', 'nestle']
+
+
+def test_incremental_update_matches_clustering(tmp_path):
+    series = pd.Series(BRANDS * 3)
+    filepath = tmp_path.joinpath('dictionary.pickle')
+    dictionary = ClusterDictionary(filepath)
+    dictionary.update(series.iloc[:8])
+    dictionary.save()
+    dictionary = ClusterDictionary(filepath)
+    dictionary.update(series.iloc[8:])
+    assert dictionary.info()['new_strings'] == 0
+    assert dictionary.apply(series).astype(object).tolist() == \
+        clustering_results(series)
+
+
+def test_snapshot_update_is_idempotent(tmp_path):
+    series = pd.Series(BRANDS, dtype='category')
+    filepath = tmp_path.joinpath('dictionary.pickle')
+    dictionary = ClusterDictionary(filepath)
+    dictionary.update(series, replace=True)
+    dictionary.save()
+    occurrences = dictionary.occurrences
+    dictionary = ClusterDictionary(filepath)
+    dictionary.update(series, replace=True)
+    assert dictionary.occurrences == occurrences
+    assert dictionary.info()['new_strings'] == 0
+    assert dictionary.apply(series).astype(object).tolist() == \
+        clustering_results(series)
+
+
+def test_load_after_dropped_strings(tmp_path):
+    filepath = tmp_path.joinpath('dictionary.pickle')
+    dictionary = ClusterDictionary(filepath)
+    dictionary.update(pd.Series(['Carrefour', 'carrefour', 'Auchan']))
+    dictionary.save()
+    dictionary = ClusterDictionary(filepath)
+    series = pd.Series(['Carrefour', 'Leclerc'])
+    dictionary.update(series, replace=True)
+    dictionary.save()
+    dictionary = ClusterDictionary(filepath)
+    assert 'Auchan' not in dictionary.mapping
+    assert dictionary.apply(series).astype(object).tolist() == \
+        clustering_results(series)